@@ -30,10 +30,18 @@ regardless of device path changes during cleanup, bcache creation, or system reb
 """
 
 import argparse
+import hashlib
+import json
 import os
+import queue
 import re
+import shutil
+import socket
 import subprocess
 import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
@@ -56,6 +64,15 @@ class Config:
     """Global configuration and state"""
     verbose = False
     auto_yes = False
+    probe_workers = 8      # Disks probed in parallel during discovery
+    probe_timeout = 30.0   # Seconds before a disk probe (or one of its commands) is abandoned
+    backend = 'tools'      # Discovery backend: 'tools' (lsblk/smartctl) or 'sysfs' (no subprocesses)
+    sysfs_root = '/sys'
+    dev_root = '/dev'
+    udev_root = '/run/udev'
+    proc_root = '/proc'
+    cache_file = '/var/cache/free-unraid/discovery.json'  # None disables the discovery cache
+    cache_ttl = 600.0      # Seconds before cached SMART readings are refreshed regardless
 
 
 def log_verbose(message: str) -> None:
@@ -79,7 +96,8 @@ def log_error(message: str) -> None:
     print(f"{Colors.FAIL}[ERROR]{Colors.ENDC} {message}", file=sys.stderr)
 
 
-def run_command(cmd: List[str], check: bool = True, capture_output: bool = True) -> subprocess.CompletedProcess:
+def run_command(cmd: List[str], check: bool = True, capture_output: bool = True,
+                timeout: Optional[float] = None) -> subprocess.CompletedProcess:
     """
     Execute a system command and return the result.
     
@@ -87,6 +105,7 @@ def run_command(cmd: List[str], check: bool = True, capture_output: bool = True)
         cmd: Command and arguments as a list
         check: Raise exception on non-zero exit code
         capture_output: Capture stdout and stderr
+        timeout: Kill the command and raise after this many seconds (None waits forever)
     
     Returns:
         CompletedProcess object with returncode, stdout, stderr
@@ -94,12 +113,22 @@ def run_command(cmd: List[str], check: bool = True, capture_output: bool = True)
     log_verbose(f"Running command: {' '.join(cmd)}")
     
     try:
-        result = subprocess.run(
+        proc = subprocess.Popen(
             cmd,
-            capture_output=capture_output,
-            text=True,
-            check=check
+            stdout=subprocess.PIPE if capture_output else None,
+            stderr=subprocess.PIPE if capture_output else None,
+            text=True
         )
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # Kill but do not wait: a command stuck in uninterruptible I/O
+            # cannot be reaped until the device answers
+            proc.kill()
+            raise
+        result = subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, cmd, stdout, stderr)
         log_verbose(f"Command exit code: {result.returncode}")
         if capture_output and result.stdout:
             log_verbose(f"Command stdout: {result.stdout.strip()}")
@@ -114,15 +143,25 @@ def run_command(cmd: List[str], check: bool = True, capture_output: bool = True)
         if e.stderr:
             log_error(f"Stderr: {e.stderr}")
         raise
+    except subprocess.TimeoutExpired:
+        log_warning(f"Command timed out after {timeout}s: {' '.join(cmd)}")
+        raise
     except FileNotFoundError:
         log_error(f"Command not found: {cmd[0]}")
         raise
 
 
-def dependency_check() -> bool:
+# Tools the read-only show command runs with the 'tools' backend
+SHOW_DEPENDENCIES = ['lsblk', 'blockdev', 'udevadm', 'smartctl']
+
+
+def dependency_check(commands: Optional[List[str]] = None) -> bool:
     """
     Validate that all required system tools are available.
     
+    Args:
+        commands: Only check these tools (None checks everything configure and reset need)
+    
     Returns:
         True if all dependencies are met, False otherwise
     """
@@ -139,21 +178,19 @@ def dependency_check() -> bool:
         'pvremove': 'LVM physical volume removal',
         'dmsetup': 'device-mapper management',
         'udevadm': 'device event management',
-        'dd': 'low-level disk operations'
+        'dd': 'low-level disk operations',
+        'lsblk': 'block device inventory'
     }
+    if commands is not None:
+        dependencies = {cmd: dependencies[cmd] for cmd in commands}
     
     log_info("Checking dependencies...")
     missing = []
     
     for cmd, description in dependencies.items():
-        try:
-            result = run_command(['which', cmd], check=False)
-            if result.returncode == 0:
-                log_verbose(f"✓ {cmd} found ({description})")
-            else:
-                log_error(f"✗ {cmd} not found ({description})")
-                missing.append(cmd)
-        except Exception:
+        if shutil.which(cmd):
+            log_verbose(f"✓ {cmd} found ({description})")
+        else:
             log_error(f"✗ {cmd} not found ({description})")
             missing.append(cmd)
     
@@ -165,112 +202,415 @@ def dependency_check() -> bool:
     return True
 
 
-def get_disk_list() -> List[str]:
+class BlockInventory:
     """
-    Get list of physical disk devices.
+    Indexed snapshot of the block device tree from a single `lsblk -J` call.
     
-    Returns:
-        List of device paths (e.g., ['/dev/sda', '/dev/sdb'])
+    Devices are keyed by their /dev path. A device with several parents (e.g.
+    an md or dm device over multiple partitions) is indexed once and listed as
+    a holder of each parent.
     """
-    disks = []
     
-    # Use lsblk to find disk devices
-    try:
-        result = run_command(['lsblk', '-ndo', 'NAME,TYPE'])
-        for line in result.stdout.strip().split('\n'):
-            if not line:
+    COLUMNS = 'NAME,TYPE,SIZE,FSTYPE,MOUNTPOINT'
+    
+    def __init__(self, report: Dict):
+        self.devices: Dict[str, Dict] = {}
+        self.holders: Dict[str, List[str]] = {}
+        self.disks: List[str] = []
+        self.mounts: Dict[str, str] = {}  # mountpoint -> device
+        for node in report.get('blockdevices', []):
+            self._add(node, None)
+    
+    def _add(self, node: Dict, parent: Optional[str]) -> None:
+        path = f"/dev/{node['name']}"
+        if parent is not None:
+            holders = self.holders.setdefault(parent, [])
+            if path not in holders:
+                holders.append(path)
+        if path not in self.devices:
+            size = node.get('size')
+            self.devices[path] = {
+                'name': path,
+                'type': node.get('type') or '',
+                'size': int(size) if size not in (None, '') else None,
+                'fstype': node.get('fstype') or '',
+                'mountpoint': node.get('mountpoint') or ''
+            }
+            if self.devices[path]['mountpoint']:
+                self.mounts[self.devices[path]['mountpoint']] = path
+            if parent is None and self.devices[path]['type'] == 'disk':
+                self.disks.append(path)
+        for child in node.get('children', []):
+            self._add(child, path)
+    
+    def descendants(self, device: str) -> List[str]:
+        """All devices stacked on `device` (partitions, bcache, their partitions...), depth first"""
+        result = []
+        stack = list(reversed(self.holders.get(device, [])))
+        while stack:
+            path = stack.pop()
+            if path in result:
                 continue
-            parts = line.split()
-            if len(parts) >= 2 and parts[1] == 'disk':
-                device = f"/dev/{parts[0]}"
-                disks.append(device)
-    except Exception as e:
-        log_error(f"Failed to get disk list: {e}")
-        return []
+            result.append(path)
+            stack.extend(reversed(self.holders.get(path, [])))
+        return result
     
-    log_verbose(f"Found {len(disks)} disk(s): {', '.join(disks)}")
-    return disks
+    def mountpoints(self, device: str) -> List[str]:
+        """Mountpoints of `device` and everything stacked on it"""
+        return [self.devices[path]['mountpoint'] for path in [device] + self.descendants(device)
+                if path in self.devices and self.devices[path]['mountpoint']]
 
 
-def get_disk_size(device: str) -> Optional[str]:
-    """Get human-readable disk size"""
+def read_sysfs_attr(path: str) -> Optional[str]:
+    """Read a sysfs attribute, stripped; None if it does not exist"""
     try:
-        result = run_command(['blockdev', '--getsize64', device])
-        size_bytes = int(result.stdout.strip())
-        
-        # Convert to human-readable format
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.1f}{unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.1f}PB"
-    except Exception:
+        with open(path, 'r', errors='replace') as f:
+            return f.read().strip()
+    except OSError:
         return None
 
 
-def get_disk_model(device: str) -> Optional[str]:
-    """Get disk model from smartctl"""
+def read_udev_data(major_minor: Optional[str]) -> Tuple[Dict[str, str], List[str]]:
+    """
+    Read the udev database entry of a block device directly.
+    
+    Args:
+        major_minor: Device number as in sysfs 'dev' (e.g., '8:0')
+    
+    Returns:
+        Tuple of (properties like ID_SERIAL_SHORT, symlinks relative to the dev root)
+    """
+    properties = {}
+    links = []
+    if not major_minor:
+        return properties, links
     try:
-        result = run_command(['smartctl', '-i', device], check=False)
-        for line in result.stdout.split('\n'):
-            if 'Device Model:' in line or 'Product:' in line or 'Model Family:' in line:
-                return line.split(':', 1)[1].strip()
-        return None
-    except Exception:
-        return None
+        with open(os.path.join(Config.udev_root, 'data', f'b{major_minor}'), 'r', errors='replace') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line.startswith('E:'):
+                    key, _, value = line[2:].partition('=')
+                    properties[key] = value
+                elif line.startswith('S:'):
+                    links.append(line[2:])
+    except OSError:
+        pass
+    return properties, links
 
 
-def get_disk_serial(device: str) -> Optional[str]:
-    """Get disk serial number from smartctl"""
+def read_mountinfo() -> Dict[str, str]:
+    """Map device numbers ('major:minor') to their first mountpoint from mountinfo"""
+    mounts = {}
     try:
-        result = run_command(['smartctl', '-i', device], check=False)
-        for line in result.stdout.split('\n'):
-            if 'Serial Number:' in line or 'Serial number:' in line:
-                return line.split(':', 1)[1].strip()
+        with open(os.path.join(Config.proc_root, 'self', 'mountinfo'), 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 4 and fields[2] not in mounts:
+                    # Spaces and other specials are octal-escaped (e.g. '\040')
+                    mounts[fields[2]] = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), fields[4])
+    except OSError:
+        pass
+    return mounts
+
+
+def _udev_decode(value: str) -> str:
+    """Decode udev's \\xNN escapes (as in ID_MODEL_ENC)"""
+    return re.sub(r'\\x([0-9a-fA-F]{2})', lambda m: chr(int(m.group(1), 16)), value)
+
+
+def read_sysfs_inventory() -> BlockInventory:
+    """
+    Build a BlockInventory from sysfs, the udev database and mountinfo without
+    running any command. Equivalent to get_block_inventory() with the tools
+    backend; paths are read below Config.sysfs_root, udev_root and proc_root.
+    
+    Returns:
+        BlockInventory of all block devices
+    """
+    block_dir = os.path.join(Config.sysfs_root, 'block')
+    mounts = read_mountinfo()
+    
+    def node(name: str, sys_dir: str) -> Dict:
+        major_minor = read_sysfs_attr(os.path.join(sys_dir, 'dev'))
+        properties, _ = read_udev_data(major_minor)
+        sectors = read_sysfs_attr(os.path.join(sys_dir, 'size'))
+        if os.path.exists(os.path.join(sys_dir, 'partition')):
+            dev_type = 'part'
+        elif name.startswith('loop'):
+            dev_type = 'loop'
+        elif name.startswith('md'):
+            dev_type = 'raid'
+        elif name.startswith('dm-'):
+            dev_type = 'dm'
+        elif read_sysfs_attr(os.path.join(sys_dir, 'device', 'type')) == '5':
+            dev_type = 'rom'
+        else:
+            dev_type = 'disk'
+        
+        children = []
+        partitions = []
+        try:
+            for entry in os.scandir(sys_dir):
+                if entry.name.startswith(name) and os.path.exists(os.path.join(entry.path, 'partition')):
+                    number = read_sysfs_attr(os.path.join(entry.path, 'partition'))
+                    partitions.append((int(number) if number and number.isdigit() else 0, entry.name, entry.path))
+        except OSError:
+            pass
+        for _, part_name, part_dir in sorted(partitions):
+            children.append(node(part_name, part_dir))
+        try:
+            holders = sorted(os.listdir(os.path.join(sys_dir, 'holders')))
+        except OSError:
+            holders = []
+        for holder in holders:
+            children.append(node(holder, os.path.join(block_dir, holder)))
+        
+        result = {
+            'name': name,
+            'type': dev_type,
+            'size': int(sectors) * 512 if sectors and sectors.isdigit() else None,
+            'fstype': properties.get('ID_FS_TYPE'),
+            'mountpoint': mounts.get(major_minor)
+        }
+        if children:
+            result['children'] = children
+        return result
+    
+    report = {'blockdevices': []}
+    try:
+        names = sorted(os.listdir(block_dir))
+    except OSError as e:
+        log_error(f"Failed to read {block_dir}: {e}")
+        names = []
+    for name in names:
+        sys_dir = os.path.join(block_dir, name)
+        try:
+            stacked = os.listdir(os.path.join(sys_dir, 'slaves'))
+        except OSError:
+            stacked = []
+        # Devices built on others (bcache, dm, md) appear under their slaves
+        if not stacked:
+            report['blockdevices'].append(node(name, sys_dir))
+    return BlockInventory(report)
+
+
+def read_sysfs_identity(device: str) -> 'SmartInfo':
+    """
+    Model and serial of a disk from sysfs and the udev database, without
+    running smartctl. SMART health is not available this way and is reported
+    as UNKNOWN.
+    """
+    dev_name = device.replace('/dev/', '')
+    sys_dir = os.path.join(Config.sysfs_root, 'block', dev_name)
+    properties, _ = read_udev_data(read_sysfs_attr(os.path.join(sys_dir, 'dev')))
+    
+    model = read_sysfs_attr(os.path.join(sys_dir, 'device', 'model'))
+    if not model and properties.get('ID_MODEL_ENC'):
+        model = _udev_decode(properties['ID_MODEL_ENC']).strip()
+    if not model and properties.get('ID_MODEL'):
+        model = properties['ID_MODEL'].replace('_', ' ')
+    
+    serial = (properties.get('ID_SERIAL_SHORT')
+              or read_sysfs_attr(os.path.join(sys_dir, 'device', 'serial'))
+              or read_sysfs_attr(os.path.join(sys_dir, 'serial')))
+    if not serial:
+        # SCSI/SATA unit serial number VPD page: 4 byte header, then ASCII
+        try:
+            with open(os.path.join(sys_dir, 'device', 'vpd_pg80'), 'rb') as f:
+                serial = f.read()[4:].decode('ascii', 'replace').strip('\x00 ')
+        except OSError:
+            pass
+    
+    return SmartInfo(model=model or None, serial=serial or None)
+
+
+def get_block_inventory() -> Optional[BlockInventory]:
+    """
+    Snapshot the whole block device tree with one lsblk call (or from sysfs
+    with the sysfs backend).
+    
+    Returns:
+        BlockInventory, or None if lsblk failed
+    """
+    if Config.backend == 'sysfs':
+        return read_sysfs_inventory()
+    try:
+        result = run_command(['lsblk', '-J', '-b', '-o', BlockInventory.COLUMNS],
+                             timeout=Config.probe_timeout)
+        return BlockInventory(json.loads(result.stdout))
+    except Exception as e:
+        log_error(f"Failed to read block devices: {e}")
         return None
+
+
+def format_size(size_bytes: float) -> str:
+    """Convert a byte count to a human-readable string (e.g., '12.7TB')"""
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.1f}{unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f}PB"
+
+
+def get_disk_list(inventory: Optional[BlockInventory] = None) -> List[str]:
+    """
+    Get list of physical disk devices.
+    
+    Args:
+        inventory: Block device snapshot to read from (taken fresh if omitted)
+    
+    Returns:
+        List of device paths (e.g., ['/dev/sda', '/dev/sdb'])
+    """
+    inventory = inventory or get_block_inventory()
+    if inventory is None:
+        return []
+    
+    disks = list(inventory.disks)
+    log_verbose(f"Found {len(disks)} disk(s): {', '.join(disks)}")
+    return disks
+
+
+def get_disk_size(device: str, inventory: Optional[BlockInventory] = None) -> Optional[str]:
+    """Get human-readable disk size (from `inventory` when given, else blockdev)"""
+    if inventory is not None and inventory.devices.get(device, {}).get('size') is not None:
+        return format_size(inventory.devices[device]['size'])
+    try:
+        result = run_command(['blockdev', '--getsize64', device], timeout=Config.probe_timeout)
+        return format_size(int(result.stdout.strip()))
     except Exception:
         return None
 
 
-def get_smart_status(device: str) -> Tuple[str, int]:
+@dataclass
+class SmartInfo:
+    """Identity and health of one disk, parsed from a single smartctl JSON report"""
+    model: Optional[str] = None
+    serial: Optional[str] = None
+    status: str = "UNKNOWN"  # HEALTHY, FAILING, STANDBY or UNKNOWN
+    hours: int = 0
+    standby: bool = False
+
+
+def parse_smartctl_json(report: Dict) -> SmartInfo:
     """
-    Get SMART health status and power-on hours.
+    Build a SmartInfo from the output of `smartctl -a -j`.
+    
+    Handles ATA, SCSI and NVMe reports. Power-on hours come from the normalized
+    power_on_time field smartctl computes itself, falling back to the NVMe health
+    log and then the raw value of ATA attribute 9.
+    
+    Args:
+        report: Decoded smartctl JSON document
     
     Returns:
-        Tuple of (status_string, hours)
+        SmartInfo record (fields smartctl did not report are left at defaults)
     """
-    status = "UNKNOWN"
-    hours = 0
+    info = SmartInfo()
+    
+    # smartctl reports a skipped low-power device as an informational message
+    for message in report.get('smartctl', {}).get('messages', []):
+        text = message.get('string', '')
+        if 'STANDBY' in text or 'SLEEP' in text:
+            info.standby = True
+            info.status = "STANDBY"
+    
+    info.model = (report.get('model_name') or report.get('scsi_model_name')
+                  or report.get('scsi_product') or report.get('product')
+                  or report.get('model_family'))
+    info.serial = report.get('serial_number')
+    
+    passed = report.get('smart_status', {}).get('passed')
+    if passed is True:
+        info.status = "HEALTHY"
+    elif passed is False:
+        info.status = "FAILING"
+    
+    hours = report.get('power_on_time', {}).get('hours')
+    if hours is None:
+        hours = report.get('nvme_smart_health_information_log', {}).get('power_on_hours')
+    if hours is None:
+        for attribute in report.get('ata_smart_attributes', {}).get('table', []):
+            if attribute.get('id') == 9:
+                # Some vendors pack minutes into the upper bytes of the raw value
+                hours = attribute.get('raw', {}).get('value', 0) & 0xFFFFFFFF
+                break
+    info.hours = int(hours or 0)
     
+    return info
+
+
+def get_udev_properties(device: str) -> Dict[str, str]:
+    """Get udev database properties (ID_SERIAL_SHORT, ID_MODEL, ...) without touching the disk"""
+    properties = {}
     try:
-        result = run_command(['smartctl', '-H', '-A', device], check=False)
-        
-        # Check health status
-        for line in result.stdout.split('\n'):
-            if 'SMART overall-health' in line or 'SMART Health Status:' in line:
-                if 'PASSED' in line or 'OK' in line:
-                    status = "HEALTHY"
-                else:
-                    status = "FAILING"
-        
-        # Get power-on hours - use RAW_VALUE (last column)
+        result = run_command(['udevadm', 'info', '--query=property', f'--name={device}'],
+                             check=False, timeout=Config.probe_timeout)
         for line in result.stdout.split('\n'):
-            if 'Power_On_Hours' in line or 'Power On Hours' in line:
-                parts = line.split()
-                # The RAW_VALUE is typically the last field in smartctl -A output
-                # Format: ID ATTRIBUTE_NAME FLAG VALUE WORST THRESH TYPE UPDATED WHEN_FAILED RAW_VALUE
-                if len(parts) >= 10:
-                    # Last field is the raw value
-                    try:
-                        hours = int(parts[-1])
-                    except ValueError:
-                        # Sometimes raw value might have additional info, try to extract first number
-                        raw_value = parts[-1].split()[0]
-                        hours = int(raw_value)
+            key, sep, value = line.partition('=')
+            if sep:
+                properties[key] = value
     except Exception:
         pass
+    return properties
+
+
+def get_smart_info(device: str) -> SmartInfo:
+    """
+    Probe a disk once with `smartctl -a -j -n standby`.
+    
+    A disk in standby is not spun up; it is reported with status STANDBY and
+    its model and serial are taken from the udev database instead.
+    
+    With the sysfs backend only model and serial are read, from sysfs and the
+    udev database.
+    
+    Returns:
+        SmartInfo record (defaults if smartctl failed)
+    """
+    if Config.backend == 'sysfs':
+        return read_sysfs_identity(device)
+    try:
+        result = run_command(['smartctl', '-a', '-j', '-n', 'standby', device],
+                             check=False, timeout=Config.probe_timeout)
+        info = parse_smartctl_json(json.loads(result.stdout))
+    except Exception as e:
+        log_verbose(f"Could not read SMART data for {device}: {e}")
+        return SmartInfo()
     
-    return status, hours
+    if info.standby:
+        log_verbose(f"{device} is in standby, not waking it for SMART data")
+        properties = get_udev_properties(device)
+        info.serial = info.serial or properties.get('ID_SERIAL_SHORT')
+        model = properties.get('ID_MODEL')
+        info.model = info.model or (model.replace('_', ' ') if model else None)
+    
+    return info
+
+
+def get_disk_model(device: str, smart: Optional[SmartInfo] = None) -> Optional[str]:
+    """Get disk model from smartctl (pass `smart` to reuse an earlier probe)"""
+    return (smart or get_smart_info(device)).model
+
+
+def get_disk_serial(device: str, smart: Optional[SmartInfo] = None) -> Optional[str]:
+    """Get disk serial number from smartctl (pass `smart` to reuse an earlier probe)"""
+    return (smart or get_smart_info(device)).serial
+
+
+def get_smart_status(device: str, smart: Optional[SmartInfo] = None) -> Tuple[str, int]:
+    """
+    Get SMART health status and power-on hours.
+    
+    Args:
+        device: Device path
+        smart: Earlier probe of the device to reuse instead of running smartctl again
+    
+    Returns:
+        Tuple of (status_string, hours); status is STANDBY for a sleeping disk
+    """
+    smart = smart or get_smart_info(device)
+    return smart.status, smart.hours
 
 
 def get_ata_slot(device: str) -> Optional[str]:
@@ -280,7 +620,7 @@ def get_ata_slot(device: str) -> Optional[str]:
         dev_name = device.replace('/dev/', '')
         
         # Try to find slot info in sysfs
-        sys_block_path = f"/sys/block/{dev_name}"
+        sys_block_path = os.path.join(Config.sysfs_root, 'block', dev_name)
         if os.path.exists(sys_block_path):
             device_link = os.readlink(sys_block_path)
             
@@ -308,34 +648,34 @@ def get_ata_slot(device: str) -> Optional[str]:
         return None
 
 
-def get_partitions(device: str) -> List[Dict[str, str]]:
+def get_partitions(device: str, inventory: Optional[BlockInventory] = None) -> List[Dict[str, str]]:
     """
     Get list of partitions on a device.
     
+    Includes everything stacked on the device (e.g. a bcache device and its
+    partitions), in lsblk tree order.
+    
+    Args:
+        device: Device path
+        inventory: Block device snapshot to read from (taken fresh if omitted)
+    
     Returns:
         List of dicts with partition information
     """
-    partitions = []
-    
-    try:
-        result = run_command(['lsblk', '-nlo', 'NAME,SIZE,FSTYPE,MOUNTPOINT', device])
-        lines = result.stdout.strip().split('\n')
-        
-        for line in lines[1:]:  # Skip first line (the device itself)
-            if not line.strip():
-                continue
-            parts = line.split(None, 3)
-            if len(parts) >= 2:
-                part_info = {
-                    'name': f"/dev/{parts[0].strip()}",
-                    'size': parts[1] if len(parts) > 1 else '',
-                    'fstype': parts[2] if len(parts) > 2 else '',
-                    'mountpoint': parts[3] if len(parts) > 3 else ''
-                }
-                partitions.append(part_info)
-    except Exception as e:
-        log_verbose(f"Could not get partitions for {device}: {e}")
+    inventory = inventory or get_block_inventory()
+    if inventory is None:
+        log_verbose(f"Could not get partitions for {device}")
+        return []
     
+    partitions = []
+    for path in inventory.descendants(device):
+        node = inventory.devices[path]
+        partitions.append({
+            'name': path,
+            'size': format_size(node['size']) if node['size'] is not None else '',
+            'fstype': node['fstype'],
+            'mountpoint': node['mountpoint']
+        })
     return partitions
 
 
@@ -349,18 +689,19 @@ def get_bcache_info(device: str) -> Optional[Dict[str, str]]:
     try:
         # Check if device is a bcache backing device
         dev_name = device.replace('/dev/', '')
-        bcache_path = f"/sys/block/{dev_name}/bcache"
+        bcache_path = os.path.join(Config.sysfs_root, 'block', dev_name, 'bcache')
         
         if not os.path.exists(bcache_path):
             # Check if this is a bcache device itself
             if dev_name.startswith('bcache'):
-                serial = get_disk_serial(device)
-                model = get_disk_model(device)
+                smart = get_smart_info(device)
+                serial = get_disk_serial(device, smart)
+                model = get_disk_model(device, smart)
                 
                 if serial and model:
                     # Try to construct by-id path
                     by_id_path = f"/dev/disk/by-id/bcache-{model.replace(' ', '_')}-{serial}"
-                    if os.path.exists(by_id_path):
+                    if os.path.exists(os.path.join(Config.dev_root, by_id_path[len('/dev/'):])):
                         return {
                             'device': device,
                             'by_id': by_id_path,
@@ -407,13 +748,13 @@ def get_bcache_info(device: str) -> Optional[Dict[str, str]]:
             
             # Find by-id symlink
             by_id = None
-            by_id_dir = Path('/dev/disk/by-id')
+            by_id_dir = Path(Config.dev_root) / 'disk' / 'by-id'
             if by_id_dir.exists():
                 for symlink in by_id_dir.iterdir():
                     if symlink.name.startswith('bcache-') and not symlink.name.endswith('-part1'):
                         target = symlink.resolve()
                         if target.name == bcache_dev:
-                            by_id = str(symlink)
+                            by_id = f"/dev/disk/by-id/{symlink.name}"
                             break
             
             return {
@@ -436,10 +777,11 @@ def get_nonraid_config(device: str) -> Optional[Dict]:
         Dict with nonraid configuration or None
     """
     try:
-        if not os.path.exists('/proc/nmdcmd'):
+        nmdcmd_path = os.path.join(Config.proc_root, 'nmdcmd')
+        if not os.path.exists(nmdcmd_path):
             return None
         
-        with open('/proc/nmdcmd', 'r') as f:
+        with open(nmdcmd_path, 'r') as f:
             content = f.read()
         
         # Parse nmdcmd output to find this device
@@ -463,50 +805,273 @@ def get_nonraid_config(device: str) -> Optional[Dict]:
     return None
 
 
+class DiscoveryCache:
+    """
+    Discovery results persisted between runs in Config.cache_file.
+    
+    The whole result is reused while the kernel uevent sequence number, the
+    mount table and /proc/nmdcmd are unchanged. Otherwise each disk's SMART
+    probe (the expensive part) is reused while the disk's own change markers
+    (device number, diskseq, size and the udev database entry, rewritten on
+    every uevent for the device) are unchanged. SMART readings older than
+    Config.cache_ttl are always refreshed.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.data = {}
+        if not path:
+            return
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.data = data
+        except (OSError, ValueError) as e:
+            log_verbose(f"Discovery cache not loaded from {path}: {e}")
+    
+    @staticmethod
+    def _digest(path: str) -> Optional[str]:
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            return None
+    
+    def state(self) -> Dict:
+        """Machine-wide change markers; any change invalidates the full result"""
+        return {
+            'backend': Config.backend,
+            'seqnum': read_sysfs_attr(os.path.join(Config.sysfs_root, 'kernel', 'uevent_seqnum')),
+            'mounts': self._digest(os.path.join(Config.proc_root, 'self', 'mountinfo')),
+            'nmdcmd': self._digest(os.path.join(Config.proc_root, 'nmdcmd'))
+        }
+    
+    @staticmethod
+    def device_key(disk: str) -> Dict:
+        """Per-device change markers, read from sysfs and the udev database"""
+        sys_dir = os.path.join(Config.sysfs_root, 'block', disk.replace('/dev/', ''))
+        major_minor = read_sysfs_attr(os.path.join(sys_dir, 'dev'))
+        try:
+            udev_mtime = os.stat(os.path.join(Config.udev_root, 'data', f'b{major_minor}')).st_mtime_ns
+        except OSError:
+            udev_mtime = None
+        return {
+            'backend': Config.backend,
+            'dev': major_minor,
+            'diskseq': read_sysfs_attr(os.path.join(sys_dir, 'diskseq')),
+            'size': read_sysfs_attr(os.path.join(sys_dir, 'size')),
+            'udev': udev_mtime
+        }
+    
+    def _fresh(self, timestamp: float) -> bool:
+        return time.time() - timestamp < Config.cache_ttl
+    
+    def system(self, state: Dict) -> Optional[Dict]:
+        """Cached discovery result if nothing changed since it was taken"""
+        cached = self.data.get('system')
+        if (cached and state['seqnum'] is not None and cached['state'] == state
+                and self._fresh(cached['time'])):
+            return cached['disks']
+        return None
+    
+    def smart(self, disk: str, key: Dict) -> Optional['SmartInfo']:
+        """Cached SMART probe of `disk` if the device did not change since"""
+        cached = self.data.get('smart', {}).get(disk)
+        if cached and key['dev'] is not None and cached['key'] == key and self._fresh(cached['time']):
+            return SmartInfo(**cached['info'])
+        return None
+    
+    def save(self, state: Dict, system: Dict, smart: Dict[str, Tuple[Dict, float, 'SmartInfo']]) -> None:
+        """Persist a discovery result and the SMART probes it used"""
+        self.data = {
+            'version': self.VERSION,
+            'system': {'state': state, 'time': time.time(), 'disks': system},
+            'smart': {disk: {'key': key, 'time': timestamp, 'info': asdict(info)}
+                      for disk, (key, timestamp, info) in smart.items()}
+        }
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log_verbose(f"Could not save discovery cache to {self.path}: {e}")
+
+
+def probe_disk(disk: str, inventory: Optional[BlockInventory] = None,
+               smart: Optional[SmartInfo] = None) -> Dict:
+    """
+    Collect hardware, SMART, partition, bcache and nonraid details for one disk.
+    
+    Safe to run concurrently for different disks; it only reads system state.
+    
+    Args:
+        disk: Device path (e.g., '/dev/sda')
+        inventory: Block device snapshot shared by all disks of one discovery
+        smart: Earlier SMART probe to reuse (smartctl is run if omitted)
+    
+    Returns:
+        Disk information dictionary (without 'unique_id')
+    """
+    log_verbose(f"Scanning {disk}...")
+    
+    if smart is None:
+        smart = get_smart_info(disk)
+    status, hours = get_smart_status(disk, smart)
+    return {
+        'disk_path': disk,
+        'raw_disk_size': get_disk_size(disk, inventory),
+        'disk_model': get_disk_model(disk, smart),
+        'disk_serial': get_disk_serial(disk, smart),
+        'disk_smart_status': status,
+        'disk_hours': hours,
+        'ata_slot': get_ata_slot(disk),
+        'partitions': get_partitions(disk, inventory),
+        'bcache': get_bcache_info(disk),
+        'nonraid_config': get_nonraid_config(disk),
+        'probe_failed': False
+    }
+
+
 def discover_system() -> Dict:
     """
     Scan system and build comprehensive disk information dictionary.
     
+    SMART probes run in parallel (up to Config.probe_workers at a time), so one
+    slow or hung device does not hold up the others. A disk whose SMART probe
+    fails or does not finish within Config.probe_timeout gets unknown model,
+    serial and health and is marked 'probe_failed'; its partitions, bcache and
+    nonraid membership still come from the block inventory and sysfs, so it is
+    never mistaken for an unused disk. Results are assembled in get_disk_list()
+    order, so output and unique IDs do not depend on which probe finishes first.
+    
+    Unless Config.cache_file is None, results are cached (see DiscoveryCache)
+    and only disks that changed since the previous discovery are probed again.
+    
     Returns:
         Nested dictionary with all disk information
     """
     log_info("Discovering system storage configuration...")
     
-    system = {}
-    disks = get_disk_list()
-    serial_to_disks = {}  # Track duplicate serials
+    cache = DiscoveryCache(Config.cache_file) if Config.cache_file else None
+    state = cache.state() if cache else None
+    system = cache.system(state) if cache else None
     
-    for disk in disks:
-        log_verbose(f"Scanning {disk}...")
+    if system is not None:
+        log_verbose(f"No device changes since the last discovery, using cached results")
+    else:
+        system = {}
+        inventory = get_block_inventory()
+        disks = get_disk_list(inventory)
+        smart_used = {}  # disk -> (device key, probe time, SmartInfo) for the cache
+        
+        # Per-disk deadlines run from when a probe actually starts, not from when
+        # it was queued behind other disks
+        started = {}
+        
+        def timed_probe(disk: str) -> SmartInfo:
+            started[disk] = time.monotonic()
+            if not cache:
+                return get_smart_info(disk)
+            key = DiscoveryCache.device_key(disk)
+            smart = cache.smart(disk, key)
+            if smart is not None:
+                log_verbose(f"{disk} unchanged, reusing cached SMART data")
+                smart_used[disk] = (key, cache.data['smart'][disk]['time'], smart)
+            else:
+                smart = get_smart_info(disk)
+                if smart != SmartInfo():
+                    smart_used[disk] = (key, time.time(), smart)
+            return smart
+        
+        # Daemon threads rather than an executor: a probe stuck in uninterruptible
+        # I/O is abandoned on timeout and must not be joined at interpreter exit
+        queued = queue.Queue()
+        for disk in disks:
+            queued.put(disk)
+        finished = queue.Queue()
+        
+        def worker():
+            while True:
+                try:
+                    disk = queued.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    finished.put((disk, timed_probe(disk), None))
+                except Exception as e:
+                    finished.put((disk, None, e))
         
-        disk_serial = get_disk_serial(disk)
+        def start_worker():
+            threading.Thread(target=worker, daemon=True).start()
         
-        # Track duplicate serials
+        for _ in range(min(max(1, Config.probe_workers), len(disks))):
+            start_worker()
+        
+        results = {}
+        timed_out = set()
+        while len(results) + len(timed_out) < len(disks):
+            now = time.monotonic()
+            deadlines = []
+            for disk, start in list(started.items()):
+                if disk in results or disk in timed_out:
+                    continue
+                deadline = start + Config.probe_timeout
+                if now >= deadline:
+                    timed_out.add(disk)
+                    # Replace the stuck worker so queued disks still get probed
+                    start_worker()
+                else:
+                    deadlines.append(deadline)
+            if len(results) + len(timed_out) == len(disks):
+                break
+            wait_for = min(deadlines) - now if deadlines else Config.probe_timeout
+            try:
+                disk, smart, error = finished.get(timeout=max(0, wait_for))
+            except queue.Empty:
+                continue
+            if disk not in timed_out:
+                results[disk] = (smart, error)
+        
+        # Assemble in disk list order so output and unique IDs are deterministic
+        failed = []
+        for disk in disks:
+            smart = None
+            if disk in timed_out:
+                log_warning(f"Timed out probing {disk} after {Config.probe_timeout}s, SMART details unavailable")
+            else:
+                smart, error = results[disk]
+                if error is not None:
+                    log_warning(f"Failed to probe {disk}: {error}")
+            
+            if smart is None:
+                failed.append(disk)
+                smart_used.pop(disk, None)
+                disk_info = probe_disk(disk, inventory, SmartInfo())
+                disk_info['probe_failed'] = True
+            else:
+                disk_info = probe_disk(disk, inventory, smart)
+            system[disk] = disk_info
+        
+        # A failed probe must not be served from the cache until the next uevent
+        if cache and not failed:
+            cache.save(state, system, smart_used)
+    
+    # Track duplicate serials
+    serial_to_disks = {}
+    for disk, disk_info in system.items():
+        disk_serial = disk_info['disk_serial']
         if disk_serial:
             if disk_serial in serial_to_disks:
                 serial_to_disks[disk_serial].append(disk)
             else:
                 serial_to_disks[disk_serial] = [disk]
-        
-        disk_info = {
-            'disk_path': disk,
-            'raw_disk_size': get_disk_size(disk),
-            'disk_model': get_disk_model(disk),
-            'disk_serial': disk_serial,
-            'disk_smart_status': None,
-            'disk_hours': 0,
-            'ata_slot': get_ata_slot(disk),
-            'partitions': get_partitions(disk),
-            'bcache': get_bcache_info(disk),
-            'nonraid_config': get_nonraid_config(disk)
-        }
-        
-        # Get SMART status
-        status, hours = get_smart_status(disk)
-        disk_info['disk_smart_status'] = status
-        disk_info['disk_hours'] = hours
-        
-        system[disk] = disk_info
     
     # Check for duplicate or missing serials and create unique identifiers
     for disk, disk_info in system.items():
@@ -725,8 +1290,8 @@ def cmd_show(args) -> int:
     Returns:
         Exit code (0 for success)
     """
-    # Run dependency check
-    if not dependency_check():
+    # Showing only reads; the sysfs backend needs no tools at all
+    if Config.backend == 'tools' and not dependency_check(SHOW_DEPENDENCIES):
         return 1
     
     # Discover system
@@ -738,11 +1303,7 @@ def cmd_show(args) -> int:
     print(f"{Colors.BOLD}{'='*80}{Colors.ENDC}")
     print(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
-    try:
-        hostname = subprocess.run(['hostname'], capture_output=True, text=True).stdout.strip()
-        print(f"Hostname: {hostname}")
-    except Exception:
-        print("Hostname: <unknown>")
+    print(f"Hostname: {socket.gethostname() or '<unknown>'}")
     
     print(f"{Colors.BOLD}{'='*80}{Colors.ENDC}\n")
     
@@ -752,8 +1313,14 @@ def cmd_show(args) -> int:
         print(f"  Model: {disk_info['disk_model'] or 'Unknown'}")
         print(f"  Serial: {disk_info['disk_serial'] or 'Unknown'}")
         print(f"  Size: {disk_info['raw_disk_size'] or 'Unknown'}")
-        print(f"  SMART Status: {disk_info['disk_smart_status']}")
-        print(f"  Power-On Hours: {disk_info['disk_hours']}")
+        if disk_info.get('probe_failed'):
+            print(f"  SMART Status: {Colors.FAIL}Probe failed or timed out{Colors.ENDC}")
+        else:
+            print(f"  SMART Status: {disk_info['disk_smart_status']}")
+        if disk_info['disk_smart_status'] == "STANDBY":
+            print(f"  Power-On Hours: Unknown (disk in standby, not woken)")
+        else:
+            print(f"  Power-On Hours: {disk_info['disk_hours']}")
         
         # Show slot with appropriate label based on device type
         if 'nvme' in disk_path:
@@ -829,6 +1396,9 @@ def cmd_configure(args) -> int:
             if unique_id and unique_id in pending_configs:
                 status = "pending"
                 status_color = Colors.OKCYAN
+            elif disk_info.get('probe_failed'):
+                status = "probe failed"
+                status_color = Colors.FAIL
             elif disk_info['bcache'] or disk_info['nonraid_config']:
                 status = "configured"
                 status_color = Colors.WARNING
@@ -881,6 +1451,12 @@ def cmd_configure(args) -> int:
         
         disk_info = system[disk_to_configure]
         
+        # Without a complete probe the disk cannot be tracked by serial
+        if disk_info.get('probe_failed'):
+            log_error(f"Cannot configure disk {disk_to_configure}: probing it failed or timed out")
+            log_error("Check the disk (dmesg, smartctl) and run 'show' again before configuring it.")
+            continue
+        
         # Store original device path and unique_id for device rename detection
         original_device_path = disk_to_configure
         device_serial = disk_info['disk_serial']
@@ -979,14 +1555,11 @@ def cmd_configure(args) -> int:
                 # Step 0.2: Unmount any partitions
                 log_info(f"Checking for mounted partitions on {bcache_dev}...")
                 try:
-                    result = run_command(['lsblk', '-nlo', 'NAME,MOUNTPOINT', bcache_dev], check=False)
-                    if result.returncode == 0:
-                        for line in result.stdout.strip().split('\n'):
-                            parts = line.split(None, 1)
-                            if len(parts) == 2 and parts[1]:
-                                mountpoint = parts[1]
-                                log_info(f"Unmounting {mountpoint}...")
-                                run_command(['umount', '-f', mountpoint], check=False)
+                    inventory = get_block_inventory()
+                    if inventory is not None:
+                        for mountpoint in inventory.mountpoints(bcache_dev):
+                            log_info(f"Unmounting {mountpoint}...")
+                            run_command(['umount', '-f', mountpoint], check=False)
                 except Exception as e:
                     log_verbose(f"Unmount issue (may be normal): {e}")
                 
@@ -1094,6 +1667,9 @@ def cmd_configure(args) -> int:
                     # Update disk_info to reflect new path
                     system = discover_system()
                     disk_info = system[disk_to_configure]
+                    if disk_info.get('probe_failed'):
+                        log_error(f"Probing {disk_to_configure} failed after cleanup. Aborting configuration for safety.")
+                        continue
                     # Verify unique_id still matches
                     if disk_info.get('unique_id') != unique_id:
                         log_error(f"Unique ID mismatch after cleanup! Expected {unique_id}, got {disk_info.get('unique_id')}")
@@ -1161,6 +1737,10 @@ def cmd_configure(args) -> int:
         
         disk_info = system[disk_to_configure]
         
+        if disk_info.get('probe_failed'):
+            log_error(f"Probing {disk_to_configure} failed after bcache creation. Aborting configuration for safety.")
+            continue
+        
         if not disk_info['bcache']:
             log_error("Failed to detect bcache device after creation")
             log_error(f"The device {disk_to_configure} may have been renamed or bcache failed to attach")
@@ -1437,6 +2017,10 @@ def cmd_reset(args) -> int:
             failed.append(disk)
             continue
         disk_info = system[disk]
+        if disk_info.get('probe_failed'):
+            log_error(f"Probing {disk} failed or timed out; refusing to reset it. Skipping.")
+            failed.append(disk)
+            continue
         print(f"  Model: {disk_info['disk_model'] or 'Unknown'}")
         print(f"  Serial: {disk_info['disk_serial'] or 'Unknown'}")
         print(f"  Size: {disk_info['raw_disk_size'] or 'Unknown'}")
@@ -1583,6 +2167,71 @@ def main():
         help='Auto-approve destructive operations (configure mode only)'
     )
     
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=Config.probe_workers,
+        help=f'Disks probed in parallel during discovery (default: {Config.probe_workers})'
+    )
+    
+    parser.add_argument(
+        '--probe-timeout',
+        type=float,
+        default=Config.probe_timeout,
+        help=f'Seconds before a hung disk probe is abandoned (default: {Config.probe_timeout:g})'
+    )
+    
+    parser.add_argument(
+        '--backend',
+        choices=['tools', 'sysfs'],
+        default=Config.backend,
+        help='Discovery backend: lsblk/smartctl, or sysfs and the udev database without '
+             'running any command (no SMART health) (default: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--sysfs-root',
+        default=Config.sysfs_root,
+        help='Where sysfs is read from (default: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--dev-root',
+        default=Config.dev_root,
+        help='Where /dev (for by-id links) is read from (default: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--udev-root',
+        default=Config.udev_root,
+        help='Where the udev database is read from (default: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--proc-root',
+        default=Config.proc_root,
+        help='Where procfs (mountinfo, nmdcmd) is read from (default: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--cache-file',
+        default=Config.cache_file,
+        help='Discovery cache reused while no device changes (default: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Probe every disk instead of reusing cached discovery results'
+    )
+    
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=Config.cache_ttl,
+        help='Seconds after which cached SMART readings are refreshed (default: %(default)g)'
+    )
+    
     subparsers = parser.add_subparsers(dest='command', help='Commands')
     
     # SHOW command
@@ -1617,6 +2266,15 @@ def main():
     # Set global config
     Config.verbose = args.verbose
     Config.auto_yes = args.yes
+    Config.probe_workers = args.jobs
+    Config.probe_timeout = args.probe_timeout
+    Config.backend = args.backend
+    Config.sysfs_root = args.sysfs_root
+    Config.dev_root = args.dev_root
+    Config.udev_root = args.udev_root
+    Config.proc_root = args.proc_root
+    Config.cache_file = None if args.no_cache else args.cache_file
+    Config.cache_ttl = args.cache_ttl
     
     # Ensure root privileges
     if os.geteuid() != 0:
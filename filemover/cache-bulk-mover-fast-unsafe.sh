@@ -4,6 +4,8 @@
 # This is my customized 'mover' script used for moving files from the cache ZFS pool to the
 # main mergerfs pool (/mnt/slow-storage).  It is typically invoked via cron and this is 
 # inspired unraid-mover script.
+# See cache-bulk-mover.py for a port that checks open files once per batch instead of
+# running fuser (a full /proc scan) for every single file.
 
 # !!! WARNING !!!
 # This script uses rsync --inplace to speed up transactions. Although it does initially 
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+# github.com/TheLinuxGuy Tiered Storage bulk mover (/cache -> /mnt/slow-storage)
+# Python port of cache-bulk-mover-fast-unsafe.sh.
+
+# The shell version runs `fuser -s` once per file through `find -exec`, and every
+# fuser call walks all of /proc. This port builds the set of open (dev, inode)
+# pairs from /proc/*/fd, /proc/*/maps, exe and cwd in one pass, refreshes it at
+# batch boundaries every --refresh-interval seconds, and skips the files found in
+# it. Like the shell version it moves everything out of the top-level share
+# directories on the cache (hidden ones and top-level files are left alone), and
+# carries empty directories over before deleting them from the cache.
+
+# !!! WARNING !!!
+# A file can still be opened between the /proc scan and its copy. With the native
+# backend the copy is written to a temporary name and the source is only removed
+# if its size and mtime did not change while copying, which narrows that window
+# compared to `rsync --inplace`, but does not close it.
+# !!! WARNING !!!
+
+# Usage example:
+# python3 cache-bulk-mover.py -s /cache -d /mnt/slow-storage
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+from moverlib import (
+    MOVE_BACKENDS,
+    SKIP_EXISTING,
+    open_inodes,
+    prune_empty_dirs,
+    scan_files,
+    setup_engine,
+)
+
+PID_FILE = '/var/run/mover.pid'
+CACHE_PATH = '/cache'
+MERGERFS_SHARE_PATH = '/mnt/cached'
+MERGERFS_ARCHIVE_PATH = '/mnt/slow-storage/'
+
+
+def check_pid():
+    """Exit quietly if a previous mover is still running."""
+    try:
+        with open(PID_FILE) as file:
+            pid = int(file.readline())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        # No PID file, or a stale one.
+        return
+    print("mover already running")
+    sys.exit(0)
+
+
+def write_pid():
+    """Create a PID File."""
+    try:
+        with open(PID_FILE, "w") as file:
+            file.write(str(os.getpid()))
+    except OSError:
+        print(f"Fatal Error: Unable to write pid file {PID_FILE}")
+        sys.exit(1)
+
+
+class OpenFiles:
+    """Snapshot of open inodes, rebuilt at most every `interval` seconds."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.refreshed = None
+        self.inodes = set()
+
+    def refresh(self):
+        now = time.monotonic()
+        if self.refreshed is None or now - self.refreshed >= self.interval:
+            self.inodes = open_inodes()
+            self.refreshed = now
+
+    def __contains__(self, st):
+        return (st.st_dev, st.st_ino) in self.inodes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s",
+        "--source",
+        dest="source",
+        default=CACHE_PATH,
+        type=Path,
+        help=f"Cache pool root path (default: {CACHE_PATH}).",
+    )
+    parser.add_argument(
+        "-d",
+        "--destination",
+        dest="destination",
+        default=MERGERFS_ARCHIVE_PATH,
+        type=Path,
+        help=f"Slow pool root path (default: {MERGERFS_ARCHIVE_PATH}).",
+    )
+    parser.add_argument(
+        "--backend",
+        dest="backend",
+        choices=sorted(MOVE_BACKENDS),
+        default="native",
+        help="Copy engine: in-process copy_file_range/sendfile, or rsync --files-from batches.",
+    )
+    parser.add_argument(
+        "--skip-existing",
+        dest="skip_existing",
+        choices=SKIP_EXISTING,
+        default="stat",
+        help="Native backend: only remove the source when the destination already has it (same size and mtime, plus sampled hashes with 'hash').",
+    )
+    parser.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        default=1000,
+        type=int,
+        help="Files checked against the open-file set and moved per batch.",
+    )
+    parser.add_argument(
+        "--refresh-interval",
+        dest="refresh_interval",
+        default=30,
+        type=float,
+        help="Seconds after which the open-file set is rebuilt from /proc.",
+    )
+    parser.add_argument(
+        "-v", "--verbose", help="Increase output verbosity.", action="store_true"
+    )
+    args = parser.parse_args()
+
+    cache_path = args.source.absolute()
+    slow_path = args.destination.absolute()
+    # Only run script if cache disk enabled and in use
+    if not cache_path.is_dir() or not os.path.isdir(MERGERFS_SHARE_PATH):
+        sys.exit(0)
+
+    check_pid()
+    write_pid()
+    print("mover started")
+
+    setup_engine(args)
+    move_batch = MOVE_BACKENDS[args.backend]
+    open_files = OpenFiles(args.refresh_interval)
+    counts = {'moved': 0, 'in_use': 0, 'incomplete': 0, 'failed': 0}
+
+    def flush(groups):
+        """Move one batch of (paths, stat) groups, skipping open files."""
+        if not groups:
+            return
+        open_files.refresh()
+        batch = []
+        for paths, st in groups:
+            if st in open_files:
+                counts['in_use'] += len(paths)
+                if args.verbose:
+                    print(f"in use, skipping: {paths[0]}")
+                continue
+            batch.append(([Path(p) for p in paths], st, slow_path))
+        for (paths, _, _), moved in zip(batch, move_batch(batch, cache_path)):
+            counts['moved' if moved else 'failed'] += len(paths)
+            if args.verbose:
+                for p in paths:
+                    print(f"{'moved' if moved else 'FAILED'}: {p}")
+
+    # Hard links are collected across every share (e.g. downloads and media)
+    # and moved together at the end so they stay linked on the array.
+    links = {}
+    shares = sorted(
+        e.path for e in os.scandir(cache_path)
+        if e.is_dir(follow_symlinks=False) and not e.name.startswith('.')
+    )
+    for share in shares:
+        print(f"moving \"{os.path.basename(share)}\"")
+        groups = []
+        for path, st in scan_files(share):
+            if st.st_nlink > 1:
+                links.setdefault((st.st_dev, st.st_ino), ([], st))[0].append(path)
+                continue
+            groups.append(([path], st))
+            if len(groups) >= args.batch_size:
+                flush(groups)
+                groups = []
+        flush(groups)
+
+    # A group missing some of its names (hidden, at the top level or outside
+    # the cache) is left alone: moving the rest would split the inode.
+    linked = []
+    for paths, st in links.values():
+        if len(paths) < st.st_nlink:
+            counts['incomplete'] += len(paths)
+            if args.verbose:
+                print(f"{st.st_nlink - len(paths)} hard link(s) not found, skipping: {paths[0]}")
+            continue
+        linked.append((paths, st))
+    for i in range(0, len(linked), args.batch_size):
+        flush(linked[i:i + args.batch_size])
+
+    for share in shares:
+        prune_empty_dirs(share, cache_path, slow_path)
+
+    print(
+        f"{counts['moved']} files moved, {counts['in_use']} skipped as in use, "
+        f"{counts['incomplete']} skipped as partly linked, {counts['failed']} failed"
+    )
+    os.unlink(PID_FILE)
+    print("mover finished")
@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+# TheLinuxGuy checksum scrubber for files moved with `--checksum`.
+# The movers can hash data while copying it and keep the digest in the
+# user.uncache.checksum xattr of the destination. This re-reads those files and
+# compares, so bitrot on a data disk can be pinned to a file (and the good copy
+# restored from parity or backup) instead of only showing up as a parity error.
+
+# Usage example:
+# python3 checksum-scrub.py -s /mnt/disk1 -s /mnt/disk2 --ionice idle
+import argparse
+import os
+import sys
+import syslog
+
+from moverlib import CHECKSUMS, hash_file, read_checksum, scan_files, set_ioprio
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s",
+        "--source",
+        dest="source",
+        action="append",
+        required=True,
+        help="Tree to scrub (e.g. a data disk or /mnt/slow-storage). May be repeated.",
+    )
+    parser.add_argument(
+        "--ionice",
+        dest="ionice",
+        default=None,
+        help="I/O class for the scrub, like ionice(1): idle, best-effort[:0-7] or realtime[:0-7].",
+    )
+    parser.add_argument(
+        "-v", "--verbose", help="Increase output verbosity.", action="store_true"
+    )
+    args = parser.parse_args()
+
+    if args.ionice:
+        set_ioprio(args.ionice)
+
+    counts = {'ok': 0, 'mismatch': 0, 'stale': 0, 'unknown': 0, 'error': 0}
+    for root in args.source:
+        for path, st in scan_files(root):
+            record = read_checksum(path)
+            if record is None:
+                continue
+            algorithm, digest, mtime_ns = record
+            if algorithm not in CHECKSUMS:
+                counts['unknown'] += 1
+                continue
+            if mtime_ns != st.st_mtime_ns:
+                # Legitimately rewritten since it was moved.
+                counts['stale'] += 1
+                if args.verbose:
+                    print(f"stale: {path}")
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                    actual = hash_file(fd, st.st_size, algorithm)
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                counts['error'] += 1
+                print(f"ERROR: {path}: {e}")
+                continue
+            if actual == digest:
+                counts['ok'] += 1
+                if args.verbose:
+                    print(f"ok: {path}")
+            else:
+                counts['mismatch'] += 1
+                print(f"MISMATCH: {path}")
+                syslog.syslog(syslog.LOG_ERR, f"Checksum mismatch (bitrot?) on {path}.")
+
+    print(", ".join(f"{n} {k}" for k, n in counts.items()))
+    sys.exit(1 if counts['mismatch'] or counts['error'] else 0)
@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+# TheLinuxGuy cache pool access-heat tracker.
+# Watches the cache pool for file opens and keeps exponentially decayed access
+# counts in a small SQLite store. The movers read it with `--order heat`, which
+# keeps files that are actually being watched on NVMe even when the pool is
+# mounted relatime/noatime and st_atime is stale.
+
+# Usage example (run as root, e.g. from a systemd unit):
+# python3 heat-tracker.py -s /cache
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import syslog
+import time
+
+from moverlib import HEAT_DB, HEAT_HALF_LIFE, HeatStore
+
+PID_FILE = '/var/run/uncache-mover.pid'
+
+# fanotify(7)
+FAN_CLOEXEC = 0x01
+FAN_NONBLOCK = 0x02
+FAN_CLASS_NOTIF = 0x00
+FAN_MARK_ADD = 0x01
+FAN_MARK_MOUNT = 0x10
+FAN_MARK_FILESYSTEM = 0x100
+FAN_OPEN = 0x20
+FAN_Q_OVERFLOW = 0x4000
+FAN_EVENT = struct.Struct('=IBBHQii')
+AT_FDCWD = -100
+
+# inotify(7)
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+IN_OPEN = 0x20
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_EVENT = struct.Struct('=iIII')
+
+libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def _check(ret):
+    if ret < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+
+class FanotifyWatcher:
+    """Whole-filesystem open events; needs CAP_SYS_ADMIN."""
+
+    def __init__(self, root, ignore_comm):
+        libc.fanotify_mark.argtypes = [
+            ctypes.c_int, ctypes.c_uint, ctypes.c_uint64, ctypes.c_int, ctypes.c_char_p
+        ]
+        self.fd = _check(libc.fanotify_init(
+            FAN_CLASS_NOTIF | FAN_CLOEXEC | FAN_NONBLOCK,
+            os.O_RDONLY | getattr(os, 'O_LARGEFILE', 0) | os.O_CLOEXEC,
+        ))
+        self.root = os.path.abspath(root)
+        self.ignore_comm = set(ignore_comm)
+        self.ignore_pids = {os.getpid()}
+        self.comm = {}
+        for flags in (FAN_MARK_FILESYSTEM, FAN_MARK_MOUNT):
+            if libc.fanotify_mark(
+                self.fd, FAN_MARK_ADD | flags, FAN_OPEN, AT_FDCWD, os.fsencode(self.root)
+            ) == 0:
+                break
+        else:
+            err = ctypes.get_errno()
+            raise OSError(err, f"fanotify_mark {self.root}: {os.strerror(err)}")
+
+    def _ignored(self, pid):
+        if pid in self.ignore_pids:
+            return True
+        comm = self.comm.get(pid)
+        if comm is None:
+            try:
+                with open(f"/proc/{pid}/comm") as file:
+                    comm = file.read().strip()
+            except OSError:
+                comm = ''
+            if len(self.comm) > 4096:
+                self.comm.clear()
+            self.comm[pid] = comm
+        return comm in self.ignore_comm
+
+    def set_ignore_pids(self, pids):
+        self.ignore_pids = {os.getpid()} | set(pids)
+        self.comm.clear()
+
+    def read(self):
+        """Yield the paths opened since the last call."""
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + FAN_EVENT.size <= len(buf):
+            event_len, _, _, _, mask, fd, pid = FAN_EVENT.unpack_from(buf, offset)
+            offset += event_len
+            if mask & FAN_Q_OVERFLOW:
+                syslog.syslog(syslog.LOG_WARNING, "fanotify queue overflow; events lost.")
+            if fd < 0:
+                continue
+            try:
+                if not self._ignored(pid):
+                    path = os.readlink(f"/proc/self/fd/{fd}")
+                    if path.startswith(self.root + '/'):
+                        yield path
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+
+class InotifyWatcher:
+    """Per-directory open events; unprivileged but cannot tell who opened."""
+
+    def __init__(self, root, ignore_comm):
+        self.fd = _check(libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK))
+        self.wd = {}
+        self.add_tree(os.path.abspath(root))
+
+    def add_tree(self, top):
+        mask = IN_OPEN | IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+            if wd < 0:
+                err = ctypes.get_errno()
+                syslog.syslog(
+                    syslog.LOG_WARNING,
+                    f"inotify_add_watch {directory}: {os.strerror(err)} (check fs.inotify.max_user_watches)",
+                )
+                continue
+            self.wd[wd] = directory
+            try:
+                with os.scandir(directory) as it:
+                    stack.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def set_ignore_pids(self, pids):
+        pass
+
+    def read(self):
+        """Yield the paths opened since the last call."""
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + IN_EVENT.size <= len(buf):
+            wd, mask, _, length = IN_EVENT.unpack_from(buf, offset)
+            name = buf[offset + IN_EVENT.size:offset + IN_EVENT.size + length]
+            offset += IN_EVENT.size + length
+            name = os.fsdecode(name.rstrip(b'\0'))
+            if mask & IN_Q_OVERFLOW:
+                syslog.syslog(syslog.LOG_WARNING, "inotify queue overflow; events lost.")
+                continue
+            if mask & IN_IGNORED:
+                self.wd.pop(wd, None)
+                continue
+            directory = self.wd.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(path)
+            elif mask & IN_OPEN:
+                yield path
+
+
+def mover_pids():
+    """PID of a running mover, whose own reads must not count as accesses."""
+    try:
+        with open(PID_FILE) as file:
+            return [int(file.readline())]
+    except (OSError, ValueError):
+        return []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s",
+        "--source",
+        dest="source",
+        action="append",
+        required=True,
+        help="Path to watch (i.e. cache pool root path). May be repeated.",
+    )
+    parser.add_argument(
+        "--heat-db",
+        dest="heat_db",
+        default=HEAT_DB,
+        help=f"Heat store location (default: {HEAT_DB}).",
+    )
+    parser.add_argument(
+        "--half-life",
+        dest="half_life",
+        default=HEAT_HALF_LIFE,
+        type=float,
+        help="Seconds after which an access counts half as much.",
+    )
+    parser.add_argument(
+        "--backend",
+        dest="backend",
+        choices=["fanotify", "inotify"],
+        default="fanotify",
+        help="Event source. fanotify needs root; inotify needs one watch per directory.",
+    )
+    parser.add_argument(
+        "--flush-interval",
+        dest="flush_interval",
+        default=30,
+        type=int,
+        help="Seconds between writes to the heat store.",
+    )
+    parser.add_argument(
+        "--ignore-comm",
+        dest="ignore_comm",
+        action="append",
+        default=["rsync"],
+        help="Process names whose opens are not counted (fanotify only). May be repeated.",
+    )
+    parser.add_argument(
+        "-v", "--verbose", help="Increase output verbosity.", action="store_true"
+    )
+    args = parser.parse_args()
+
+    watcher_class = FanotifyWatcher if args.backend == "fanotify" else InotifyWatcher
+    try:
+        watchers = [watcher_class(path, args.ignore_comm) for path in args.source]
+    except OSError as e:
+        print(f"Fatal error: unable to watch with {args.backend}: {e}")
+        sys.exit(1)
+
+    store = HeatStore(args.heat_db, half_life=args.half_life)
+    running = True
+
+    def stop(signum, frame):
+        global running
+        running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    syslog.syslog(
+        syslog.LOG_INFO,
+        f"Tracking access heat on {', '.join(args.source)} with {args.backend} into {args.heat_db}.",
+    )
+    poller = select.poll()
+    for w in watchers:
+        poller.register(w.fd, select.POLLIN)
+    by_fd = {w.fd: w for w in watchers}
+
+    counts = {}
+    last_flush = time.monotonic()
+    last_prune = last_flush
+    while running:
+        try:
+            ready = poller.poll(1000)
+        except InterruptedError:
+            continue
+        for fd, _ in ready:
+            for path in by_fd[fd].read():
+                counts[path] = counts.get(path, 0) + 1
+
+        now = time.monotonic()
+        if now - last_flush >= args.flush_interval or not running:
+            if counts:
+                store.record(counts)
+                if args.verbose:
+                    syslog.syslog(syslog.LOG_DEBUG, f"Recorded {len(counts)} accessed files.")
+                counts = {}
+            pids = mover_pids()
+            for w in watchers:
+                w.set_ignore_pids(pids)
+            last_flush = now
+        if now - last_prune >= 3600:
+            pruned = store.prune()
+            if args.verbose:
+                syslog.syslog(syslog.LOG_DEBUG, f"Pruned {pruned} cold entries.")
+            last_prune = now
+
+    store.close()
+    syslog.syslog(syslog.LOG_INFO, "Heat tracker stopped.")
@@ -0,0 +1,366 @@
+#!/usr/bin/python3
+# TheLinuxGuy mover benchmark.
+# Generates a synthetic cache tree (media, subtitles and metadata files with
+# skewed atimes, hard-link groups and sparse files), then times candidate
+# scanning, planning and moving with uncache-mover.py and zfs-uncache-mover.py.
+# Results are written as one JSON document so runs can be compared over time.
+
+# Usage examples (run as root; the movers take the same PID lock as in production):
+# python3 mover-benchmark.py --fs tmpfs --size 8G --files 100000 -o results.json
+# python3 mover-benchmark.py --fs loop --fstype xfs --size 64G --files 1000000
+# python3 mover-benchmark.py --fs zfs --size 16G --movers zfs-uncache-mover
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MOVERS = {
+    'uncache-mover': os.path.join(HERE, 'uncache-mover.py'),
+    'zfs-uncache-mover': os.path.join(HERE, 'zfs-uncache-mover.py'),
+}
+
+# (share, weight, median size, sigma, extensions): log-normal file sizes.
+PROFILES = [
+    ('media', 0.05, 1500 * 1024**2, 0.8, ['.mkv', '.mp4']),
+    ('subtitles', 0.25, 60 * 1024, 0.5, ['.srt', '.ass']),
+    ('metadata', 0.70, 40 * 1024, 1.2, ['.nfo', '.jpg', '.xml']),
+]
+FILES_PER_DIR = 200
+# zfs-uncache-mover takes the pool name from its source path, so the
+# benchmark pool is mounted at /<name>.
+ZFS_POOL = 'moverbench'
+
+
+def mount(args, root):
+    """Mount a tmpfs, a loop filesystem or a file-backed ZFS pool on `root`; returns the cleanup."""
+    if args.fs == 'zfs':
+        pool = root.lstrip('/')
+        image = os.path.join(args.workdir, 'cache.zfs.img')
+        subprocess.check_call(['truncate', '-s', args.size, image])
+        subprocess.check_call(['zpool', 'create', '-f', '-O', 'atime=on', '-m', root, pool, image])
+
+        def destroy():
+            subprocess.call(['zpool', 'destroy', '-f', pool])
+            os.unlink(image)
+        return destroy
+    os.makedirs(root, exist_ok=True)
+    if args.fs == 'tmpfs':
+        subprocess.check_call(['mount', '-t', 'tmpfs', '-o', f'size={args.size}', 'tmpfs', root])
+        return lambda: subprocess.call(['umount', root])
+    image = os.path.join(args.workdir, f'cache.{args.fstype}.img')
+    subprocess.check_call(['truncate', '-s', args.size, image])
+    subprocess.check_call([f'mkfs.{args.fstype}', '-q', image], stdout=subprocess.DEVNULL)
+    subprocess.check_call(['mount', '-o', 'loop', image, root])
+
+    def cleanup():
+        subprocess.call(['umount', root])
+        os.unlink(image)
+    return cleanup
+
+
+def generate(root, args):
+    """
+    Create `args.files` files below root/<share>/dNNNNN/. Sizes are drawn
+    per profile and scaled by `args.scale`; media files are sparse unless
+    --dense, so multi-GB trees fit on a small tmpfs while still exercising
+    the hole-aware copy. Atimes follow a power law over `args.days` (a few
+    hot files, a long cold tail).
+    """
+    rng = random.Random(args.seed)
+    now = time.time()
+    weights = [p[1] for p in PROFILES]
+    counts = {p[0]: 0 for p in PROFILES}
+    stats = {'files': 0, 'bytes': 0, 'allocated': 0, 'hardlinks': 0, 'sparse': 0}
+    dirs = {}
+    media = []
+    t_start = time.monotonic()
+    for n in range(args.files):
+        share, _, median, sigma, exts = rng.choices(PROFILES, weights)[0]
+        i = counts[share]
+        counts[share] += 1
+        d = dirs.get((share, i // FILES_PER_DIR))
+        if d is None:
+            d = os.path.join(root, share, f'd{i // FILES_PER_DIR:05d}')
+            os.makedirs(d, exist_ok=True)
+            dirs[(share, i // FILES_PER_DIR)] = d
+        path = os.path.join(d, f'f{i:07d}{rng.choice(exts)}')
+        size = max(1, int(rng.lognormvariate(math.log(median), sigma) * args.scale))
+        sparse = share == 'media' and not args.dense or rng.random() < args.sparse
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            if sparse:
+                # A data extent at each end, a hole in between.
+                os.write(fd, os.urandom(min(size, 4096)))
+                os.ftruncate(fd, size)
+                if size > 8192:
+                    os.pwrite(fd, os.urandom(4096), size - 4096)
+                stats['sparse'] += 1
+            else:
+                chunk = os.urandom(min(size, 1024 * 1024))
+                left = size
+                while left > 0:
+                    left -= os.write(fd, chunk[:left])
+        finally:
+            os.close(fd)
+        age = args.days * 86400 * rng.random() ** args.skew
+        os.utime(path, (now - age, now - age - rng.random() * 86400))
+        st = os.stat(path)
+        stats['files'] += 1
+        stats['bytes'] += size
+        stats['allocated'] += st.st_blocks * 512
+        if share == 'media':
+            media.append(path)
+
+    # Hard-link groups, like a download client seeding what the library imported.
+    links = os.path.join(root, 'downloads')
+    for path in rng.sample(media, int(len(media) * args.hardlinks)):
+        os.makedirs(links, exist_ok=True)
+        os.link(path, os.path.join(links, os.path.basename(path)))
+        stats['hardlinks'] += 1
+    stats['seconds'] = time.monotonic() - t_start
+    stats['directories'] = len(dirs)
+    return stats
+
+
+def drop_caches():
+    """Cold-cache runs; needs root, silently skipped otherwise."""
+    try:
+        os.sync()
+        with open('/proc/sys/vm/drop_caches', 'w') as file:
+            file.write('3')
+    except OSError:
+        pass
+
+
+def run_mover(mover, source, destination, target, extra, workdir):
+    """Run one mover and return its metrics JSON line plus the wall time."""
+    metrics = os.path.join(workdir, 'metrics.json')
+    if os.path.exists(metrics):
+        os.unlink(metrics)
+    cmd = [
+        sys.executable, MOVERS[mover],
+        '-s', source,
+        '-d', destination,
+        '-t', f'{target:.4f}',
+        '--journal', os.path.join(workdir, 'journal'),
+        '--metrics-json', metrics,
+    ] + extra
+    t_start = time.monotonic()
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    result = {'command': cmd[1:], 'returncode': proc.returncode, 'wall': time.monotonic() - t_start}
+    if proc.returncode:
+        result['stderr'] = proc.stderr[-2000:]
+    try:
+        with open(metrics) as file:
+            result['metrics'] = json.loads(file.readlines()[-1])
+    except (OSError, IndexError, ValueError):
+        result['metrics'] = None
+    return result
+
+
+def target_for(source, fraction, allocated, pool=None):
+    """Usage target (%) making the movers free `fraction` of the tree."""
+    if pool:
+        # zfs-uncache-mover measures the pool, like `zpool list`.
+        out = subprocess.check_output(['zpool', 'list', '-Hp', '-o', 'size,alloc', pool], text=True)
+        total, used = (int(v) for v in out.split())
+    else:
+        st = os.statvfs(source)
+        total = st.f_blocks * st.f_frsize
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    return max(100 * (used - fraction * allocated) / total, 1.01)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workdir",
+        dest="workdir",
+        default=None,
+        help="Scratch directory for the trees and results (default: a new temporary directory).",
+    )
+    parser.add_argument(
+        "--fs",
+        dest="fs",
+        choices=["dir", "tmpfs", "loop", "zfs"],
+        default="dir",
+        help="Filesystem for the cache tree: a plain directory, a fresh tmpfs, a loop-mounted image, "
+             f"or a file-backed ZFS pool mounted at /{ZFS_POOL} (needed for zfs-uncache-mover).",
+    )
+    parser.add_argument(
+        "--fstype",
+        dest="fstype",
+        default="xfs",
+        help="mkfs type for --fs loop (default: xfs).",
+    )
+    parser.add_argument(
+        "--size",
+        dest="size",
+        default="8G",
+        help="Size of the tmpfs, loop image or ZFS pool file (default: 8G).",
+    )
+    parser.add_argument(
+        "--files",
+        dest="files",
+        default=10000,
+        type=int,
+        help="Number of files to generate (default: 10000).",
+    )
+    parser.add_argument(
+        "--scale",
+        dest="scale",
+        default=1.0,
+        type=float,
+        help="Factor applied to every file size; lower it for multi-million file trees (default: 1).",
+    )
+    parser.add_argument(
+        "--dense",
+        dest="dense",
+        action="store_true",
+        help="Write media files in full instead of sparse.",
+    )
+    parser.add_argument(
+        "--sparse",
+        dest="sparse",
+        default=0.01,
+        type=float,
+        help="Fraction of other files made sparse (default: 0.01).",
+    )
+    parser.add_argument(
+        "--hardlinks",
+        dest="hardlinks",
+        default=0.2,
+        type=float,
+        help="Fraction of media files hard linked into downloads/ (default: 0.2).",
+    )
+    parser.add_argument(
+        "--days",
+        dest="days",
+        default=365,
+        type=float,
+        help="Age span of the atimes (default: 365).",
+    )
+    parser.add_argument(
+        "--skew",
+        dest="skew",
+        default=0.5,
+        type=float,
+        help="atime skew exponent; below 1 pushes most files towards old (default: 0.5).",
+    )
+    parser.add_argument(
+        "--move-fraction",
+        dest="move_fraction",
+        default=0.3,
+        type=float,
+        help="Share of the tree's allocated bytes the movers have to free (default: 0.3).",
+    )
+    parser.add_argument(
+        "--movers",
+        dest="movers",
+        default="uncache-mover,zfs-uncache-mover",
+        help="Comma separated movers to time; zfs-uncache-mover only runs with --fs zfs.",
+    )
+    parser.add_argument(
+        "--mover-args",
+        dest="mover_args",
+        default="",
+        help="Extra arguments passed to every mover run (e.g. '--backend rsync --order gdsf').",
+    )
+    parser.add_argument(
+        "--seed",
+        dest="seed",
+        default=1,
+        type=int,
+        help="Random seed; the same seed and options give the same tree.",
+    )
+    parser.add_argument(
+        "--cold",
+        dest="cold",
+        action="store_true",
+        help="Drop the page/dentry caches before each run.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default="-",
+        help="Where to write the JSON results (default: stdout).",
+    )
+    args = parser.parse_args()
+
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix="mover-benchmark.")
+    os.makedirs(args.workdir, exist_ok=True)
+    extra = args.mover_args.split()
+    results = {
+        'created': time.time(),
+        'host': platform.node(),
+        'kernel': platform.release(),
+        'python': platform.python_version(),
+        'options': {k: v for k, v in vars(args).items() if k not in ('output', 'workdir')},
+        'runs': [],
+        'failed': [],
+    }
+    if args.fs == 'zfs' and shutil.which('zpool') is None:
+        parser.error("--fs zfs needs zpool.")
+
+    for mover in args.movers.split(','):
+        if mover not in MOVERS:
+            parser.error(f"Unknown mover {mover}; choose from {', '.join(MOVERS)}.")
+        if mover == 'zfs-uncache-mover' and args.fs != 'zfs':
+            # It reads capacity from the pool named after its source path.
+            results['runs'].append({'mover': mover, 'skipped': 'needs --fs zfs'})
+            continue
+        source = f'/{ZFS_POOL}' if args.fs == 'zfs' else os.path.join(args.workdir, 'cache')
+        destination = os.path.join(args.workdir, 'slow')
+        cleanup = mount(args, source) if args.fs != 'dir' else None
+        try:
+            os.makedirs(source, exist_ok=True)
+            os.makedirs(destination, exist_ok=True)
+            tree = generate(source, args)
+            results.setdefault('tree', tree)
+            target = target_for(
+                source, args.move_fraction, tree['allocated'],
+                pool=ZFS_POOL if mover == 'zfs-uncache-mover' else None,
+            )
+            runs = []
+            # Scan and planning only.
+            if args.cold:
+                drop_caches()
+            runs.append(dict(mode='plan', **run_mover(
+                mover, source, destination, target,
+                extra + ['--dry-run', '--plan-output', os.devnull], args.workdir,
+            )))
+            # Scan, planning and moving.
+            if args.cold:
+                drop_caches()
+            runs.append(dict(mode='move', **run_mover(
+                mover, source, destination, target, extra, args.workdir,
+            )))
+            for run in runs:
+                # A failed run has no meaningful timings; keep it apart.
+                outcome = 'failed' if run['returncode'] else 'runs'
+                results[outcome].append(dict(mover=mover, target=target, **run))
+        finally:
+            if cleanup:
+                cleanup()
+            if args.fs != 'zfs':
+                shutil.rmtree(source, ignore_errors=True)
+            shutil.rmtree(destination, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    for run in results['failed']:
+        print(f"{run['mover']} {run['mode']} run failed: {run.get('stderr', '').strip()}", file=sys.stderr)
+    sys.exit(1 if results['failed'] else 0)
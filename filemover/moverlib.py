@@ -0,0 +1,2727 @@
+#!/usr/bin/python3
+# TheLinuxGuy shared helpers for the mergerfs tiered cache movers.
+# Imported by uncache-mover.py and zfs-uncache-mover.py (same directory).
+import atexit
+import collections
+import csv
+import ctypes
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import heapq
+import json
+import itertools
+import os
+import platform
+import re
+import signal
+import socketserver
+import sqlite3
+import stat
+import subprocess
+import sys
+import syslog
+import tempfile
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+INDEX_DB = '/var/lib/uncache-mover/index.db'
+HEAT_DB = '/var/lib/uncache-mover/heat.db'
+JOURNAL = '/var/lib/uncache-mover/journal'
+STATUS_SOCKET = '/run/uncache-mover.sock'
+# Suffix of the native engine's temporary files, so crash recovery can tell
+# them apart from user files.
+TMP_SUFFIX = '.uncache-tmp'
+HEAT_HALF_LIFE = 7 * 24 * 3600  # seconds
+
+# Subset of os.stat_result carried by the index; attribute names match so the
+# movers can use either interchangeably.
+IndexedStat = namedtuple(
+    'IndexedStat',
+    ['st_dev', 'st_ino', 'st_size', 'st_blocks', 'st_nlink', 'st_atime', 'st_mtime'],
+)
+
+
+def freed_bytes(st):
+    """
+    Bytes actually released by removing the last link to a file.
+
+    st_blocks counts allocated 512-byte units, so holes in sparse files and
+    ZFS compression are accounted for, unlike st_size.
+    """
+    return st.st_blocks * 512
+
+
+def scan_files(root, prune=None):
+    """
+    Walk root with os.scandir and yield (path, stat) for every regular file.
+
+    Directory entries carry their type from getdents(), so only regular files
+    are stat'ed and the whole tree is never held in memory. Symlinks are not
+    followed. Entries for which `prune(path)` is true are skipped before any
+    stat(), directories with everything below them.
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        directory = stack.pop()
+        scanning = stat_time = 0.0
+        t = time.perf_counter()
+        try:
+            it = os.scandir(directory)
+        except OSError as e:
+            syslog.syslog(syslog.LOG_WARNING, f"Unable to scan {directory}: {e}")
+            continue
+        with it:
+            for entry in it:
+                if prune and prune(entry.path):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        t_stat = time.perf_counter()
+                        st = entry.stat(follow_symlinks=False)
+                        t_done = time.perf_counter()
+                        scanning += t_stat - t
+                        stat_time += t_done - t_stat
+                        yield entry.path, st
+                        t = time.perf_counter()
+                except OSError:
+                    # File vanished between readdir and stat.
+                    continue
+        scanning += time.perf_counter() - t
+        metrics.add('scan', scanning)
+        metrics.add('stat', stat_time)
+
+
+class _Hottest:
+    """Heap entry that orders hottest first (heapq is a min-heap)."""
+
+    __slots__ = ('key', 'seq', 'path', 'st')
+
+    def __init__(self, key, seq, path, st):
+        self.key = key
+        self.seq = seq
+        self.path = path
+        self.st = st
+
+    def __lt__(self, other):
+        return (self.key, self.seq) > (other.key, other.seq)
+
+
+def atime_key(path, st):
+    """Default eviction order: least recently accessed first."""
+    return st.st_atime
+
+
+def coldest_files(files, deficit, key=atime_key):
+    """
+    Keep only the coldest files needed to free `deficit` bytes.
+
+    `files` is an iterable of (path, stat) and `key(path, stat)` returns a
+    sortable "temperature". A max-heap on that key holds the current eviction
+    set; whenever the set still covers the deficit without its hottest member,
+    that member is dropped. Memory is bounded by the size of the eviction set,
+    not by the number of files scanned.
+
+    Returns a list of (path, stat) sorted coldest first.
+    """
+    heap = []
+    tiebreak = itertools.count()
+    total = 0
+    for path, st in files:
+        k = key(path, st)
+        if heap and total >= deficit and k >= heap[0].key:
+            # Hotter than everything already selected; cannot help.
+            continue
+        heapq.heappush(heap, _Hottest(k, next(tiebreak), path, st))
+        total += freed_bytes(st)
+        while heap and total - freed_bytes(heap[0].st) >= deficit:
+            total -= freed_bytes(heapq.heappop(heap).st)
+    heap.sort(key=lambda h: (h.key, h.seq))
+    return [(h.path, h.st) for h in heap]
+
+
+def _flatten_key(key):
+    """Eviction keys may be nested tuples (policy, heat); lay them out as floats."""
+    if isinstance(key, tuple):
+        return [f for k in key for f in _flatten_key(k)]
+    return [float(key)]
+
+
+class CandidateTable:
+    """
+    Struct-of-arrays store of scanned files for --compact selection.
+
+    Each file costs one row in typed arrays (inode, size, blocks, key
+    columns, directory id, end of its name in a shared byte buffer) plus its
+    name bytes, 60-70 bytes in all; directory paths are interned once.
+    That is several times less than a path string and an os.stat_result per
+    file, so the whole pool can be ranked at once. Sorting and the cumulative
+    size cutoff run vectorized with numpy when it is installed.
+    """
+
+    def __init__(self):
+        self.dirs = []
+        self._dir_ids = {}
+        self.dir_id = array('I')
+        self.name_end = array('Q')
+        self.names = bytearray()
+        self.ino = array('Q')
+        self.size = array('Q')
+        self.blocks = array('Q')
+        self.keys = array('d')
+        self.width = None
+
+    def __len__(self):
+        return len(self.ino)
+
+    def append(self, path, st, key):
+        directory, name = os.path.split(path)
+        d = self._dir_ids.get(directory)
+        if d is None:
+            d = self._dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        key = _flatten_key(key)
+        if self.width is None:
+            self.width = len(key)
+        elif len(key) != self.width:
+            raise ValueError(f"Eviction key of {path} has {len(key)} fields, expected {self.width}.")
+        self.dir_id.append(d)
+        self.names += os.fsencode(name)
+        self.name_end.append(len(self.names))
+        self.ino.append(st.st_ino)
+        self.size.append(st.st_size)
+        self.blocks.append(st.st_blocks)
+        self.keys.extend(key)
+
+    def path(self, row):
+        start = self.name_end[row - 1] if row else 0
+        name = os.fsdecode(bytes(self.names[start:self.name_end[row]]))
+        return os.path.join(self.dirs[self.dir_id[row]], name)
+
+    def _sorted(self):
+        n = len(self)
+        if numpy is not None:
+            keys = numpy.frombuffer(self.keys, dtype=numpy.float64).reshape(n, self.width)
+            # lexsort sorts by its last key first.
+            return numpy.lexsort(keys.T[::-1])
+        width, keys = self.width, self.keys
+        if width == 1:
+            return sorted(range(n), key=keys.__getitem__)
+        return sorted(range(n), key=lambda i: keys[i * width:(i + 1) * width])
+
+    def order(self):
+        """Yield every row, coldest first."""
+        if len(self):
+            for row in self._sorted():
+                yield int(row)
+
+    def coldest(self, deficit):
+        """Rows, coldest first, up to the first one whose cumulative size covers `deficit`."""
+        if not len(self) or deficit <= 0:
+            return []
+        order = self._sorted()
+        if numpy is not None:
+            freed = numpy.frombuffer(self.blocks, dtype=numpy.uint64)[order] * 512
+            cut = int(numpy.searchsorted(numpy.cumsum(freed), deficit)) + 1
+            return order[:cut].tolist()
+        rows = []
+        total = 0
+        for row in order:
+            if total >= deficit:
+                break
+            rows.append(row)
+            total += self.blocks[row] * 512
+        return rows
+
+
+def coldest_files_compact(files, deficit, key=atime_key):
+    """
+    coldest_files() over a CandidateTable: every file is ranked, but only
+    the selected ones are turned back into (path, stat), re-stat'ed so that
+    files replaced since the scan are dropped and the next rows in order
+    make up for them.
+    """
+    table = CandidateTable()
+    for path, st in files:
+        table.append(path, st, key(path, st))
+    syslog.syslog(syslog.LOG_DEBUG, f"Ranking {len(table)} files in {len(table.dirs)} directories.")
+    selected = []
+    total = 0
+    if deficit <= 0:
+        return selected
+    first = table.coldest(deficit)
+    # The full order is only sorted again if rechecked rows fall short.
+    rest = itertools.islice(table.order(), len(first), None)
+    for row in itertools.chain(first, rest):
+        path = table.path(row)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if (st.st_ino, st.st_size) != (table.ino[row], table.size[row]):
+            continue
+        selected.append((path, st))
+        total += freed_bytes(st)
+        if total >= deficit:
+            break
+    return selected
+
+
+def _first_links(files, links, nlinks):
+    """
+    Yield every inode once. Paths of multi-link inodes are collected in
+    `links[(st_dev, st_ino)]` and their link counts in `nlinks`, so the group
+    can be expanded (or found incomplete) after selection; only hard-linked
+    files are remembered, not the whole pool.
+    """
+    for path, st in files:
+        if st.st_nlink > 1:
+            seen = links.get((st.st_dev, st.st_ino))
+            if seen is not None:
+                seen.append(path)
+                continue
+            links[(st.st_dev, st.st_ino)] = [path]
+            nlinks[(st.st_dev, st.st_ino)] = st.st_nlink
+        yield path, st
+
+
+def parse_size(value):
+    """Byte count from an int or a string such as '512K' or '1.5G'."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = value.strip().upper().removesuffix('B')
+    units = 'KMGTP'
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * 1024 ** (units.index(value[-1]) + 1))
+    return int(value)
+
+
+def _glob_regex(prefix, pattern):
+    """
+    Regex source matching `pattern` below `prefix` (a cache-relative
+    directory, '' for the root), and everything inside what it matches.
+    Patterns without a '/' match a name at any depth, like .gitignore.
+    """
+    pattern = pattern.strip('/')
+    glob = fnmatch.translate(pattern).removesuffix(r'\Z')
+    if '/' not in pattern:
+        glob = f"(?:.*/)?{glob}"
+    if prefix:
+        glob = f"{re.escape(prefix)}/{glob}"
+    return f"(?:{glob}(?:/.*)?)"
+
+
+class Policy:
+    """
+    Per-share eviction rules, loaded from a TOML (or JSON) file:
+
+    ::
+
+        [default]
+        never = ["*.!qB", ".Trash-*"]
+
+        [shares."media/movies"]
+        priority = 10          # evicted before lower priorities
+        min_size = "100M"      # small files stay on the cache
+        min_age = 2            # days since last modification
+
+        [shares.documents]
+        priority = -10
+        max_age = 30           # always moved once unmodified this long
+        never = ["*.kdbx"]
+        always = ["archive"]
+
+        [shares."media/downloads"]
+        never = ["incomplete"]
+
+    Shares are paths relative to the cache root; a file follows the deepest
+    share containing it and [default] otherwise, and unset keys fall back to
+    [default]. Globs are relative to their share. All never-move globs are
+    compiled into one regex, so excluded directories are pruned from the walk
+    and nothing below them is stat'ed; the same goes for always-move globs.
+    Always-move files (and files older than max_age) are evicted first and
+    ignore min_age and the size limits.
+    """
+
+    SETTINGS = {
+        'priority': 0,
+        'min_age': 0,
+        'max_age': None,
+        'min_size': 0,
+        'max_size': None,
+    }
+
+    def __init__(self, root, config):
+        self.root = os.path.abspath(root)
+        self.pruned = 0
+        default = dict(self.SETTINGS, **{
+            k: v for k, v in config.get('default', {}).items() if k in self.SETTINGS
+        })
+        never = [_glob_regex('', g) for g in config.get('default', {}).get('never', [])]
+        always = [_glob_regex('', g) for g in config.get('default', {}).get('always', [])]
+        self.shares = []
+        for share, rules in config.get('shares', {}).items():
+            share = share.strip('/')
+            unknown = set(rules) - set(self.SETTINGS) - {'never', 'always'}
+            if unknown:
+                raise ValueError(f"Unknown policy keys for share {share}: {', '.join(sorted(unknown))}")
+            settings = dict(default, **{k: v for k, v in rules.items() if k in self.SETTINGS})
+            self.shares.append((share + '/', self._compile_settings(settings)))
+            never += [_glob_regex(share, g) for g in rules.get('never', [])]
+            always += [_glob_regex(share, g) for g in rules.get('always', [])]
+        # Deepest share first, so the first prefix match wins.
+        self.shares.sort(key=lambda s: len(s[0]), reverse=True)
+        self.default = self._compile_settings(default)
+        self.never = re.compile(f"(?:{'|'.join(never)})\\Z") if never else None
+        self.always = re.compile(f"(?:{'|'.join(always)})\\Z") if always else None
+
+    @staticmethod
+    def _compile_settings(settings):
+        day = 24 * 3600
+        return {
+            'priority': float(settings['priority']),
+            'min_age': float(settings['min_age']) * day,
+            'max_age': None if settings['max_age'] is None else float(settings['max_age']) * day,
+            'min_size': parse_size(settings['min_size']),
+            'max_size': None if settings['max_size'] is None else parse_size(settings['max_size']),
+        }
+
+    @classmethod
+    def load(cls, path, root):
+        with open(path, 'rb') as file:
+            data = file.read()
+        if os.fspath(path).endswith('.json'):
+            return cls(root, json.loads(data))
+        try:
+            import tomllib
+        except ImportError:
+            # Python < 3.11: JSON policies only.
+            try:
+                return cls(root, json.loads(data))
+            except ValueError:
+                raise ValueError(
+                    f"{path}: TOML policies need Python 3.11 (tomllib); use a JSON policy instead."
+                ) from None
+        return cls(root, tomllib.loads(data.decode()))
+
+    @property
+    def prune_only(self):
+        """True when the policy only excludes paths, so it does not change the order."""
+        return not self.shares and self.always is None and self.default == self._compile_settings(self.SETTINGS)
+
+    def _relative(self, path):
+        path = os.fspath(path)
+        return path[len(self.root) + 1:] if path.startswith(self.root + '/') else None
+
+    def rules(self, rel):
+        for share, rules in self.shares:
+            if rel.startswith(share):
+                return rules
+        return self.default
+
+    def prune(self, path):
+        """True when `path` (a file or a whole directory) must never move."""
+        rel = self._relative(path)
+        if rel is not None and self.never and self.never.match(rel):
+            self.pruned += 1
+            return True
+        return False
+
+    def _forced(self, rel, rules, st, now):
+        if self.always and self.always.match(rel):
+            return True
+        return rules['max_age'] is not None and now - st.st_mtime >= rules['max_age']
+
+    def filter(self, files):
+        """Drop the (path, stat) pairs the policy does not allow to move yet."""
+        now = time.time()
+        for path, st in files:
+            rel = self._relative(path)
+            if rel is None:
+                yield path, st
+                continue
+            if self.never and self.never.match(rel):
+                self.pruned += 1
+                continue
+            rules = self.rules(rel)
+            if not self._forced(rel, rules, st, now):
+                if now - st.st_mtime < rules['min_age'] or st.st_size < rules['min_size']:
+                    continue
+                if rules['max_size'] is not None and st.st_size > rules['max_size']:
+                    continue
+            yield path, st
+
+    def key(self, key):
+        """
+        Wrap an eviction key: forced files first, then higher share priority
+        first, then `key` within the same priority.
+        """
+        def policy_key(path, st):
+            rel = self._relative(path)
+            if rel is None:
+                return (1, 0.0, key(path, st))
+            rules = self.rules(rel)
+            forced = self._forced(rel, rules, st, time.time())
+            return (0 if forced else 1, -rules['priority'], key(path, st))
+        return policy_key
+
+
+def select_candidates(
+    cache_path, deficit, index=None, key=atime_key, policy=None, compact=False
+):
+    """
+    Pick the eviction set for `cache_path`, from the index when one is given
+    and from a streaming walk otherwise. A `policy` prunes the walk, filters
+    files and orders them by share priority. With `compact` the
+    ranking uses a CandidateTable instead of the bounded heap.
+
+    Returns a list of (paths, stat) groups: every hard link of an inode moves
+    together, and its bytes are only counted once. Groups with links outside
+    the scanned (or never-moved) set are left alone, since moving some of the
+    names would not free anything.
+    """
+    t_start = time.perf_counter()
+    walked = metrics.phases['scan'] + metrics.phases['stat']
+    pruned = policy.pruned if policy else 0
+    groups = _select(cache_path, deficit, index, key, policy, compact)
+    walked = metrics.phases['scan'] + metrics.phases['stat'] - walked
+    metrics.add('plan', time.perf_counter() - t_start - walked)
+    if policy:
+        metrics.count('skipped', policy.pruned - pruned)
+    return groups
+
+
+def _select(cache_path, deficit, index, key, policy, compact):
+    if index is not None and key is atime_key and not compact and (policy is None or policy.prune_only):
+        return index.coldest(cache_path, deficit, prune=policy.prune if policy else None)
+
+    if policy:
+        key = policy.key(key)
+    rank = coldest_files_compact if compact else coldest_files
+
+    def eligible(skip):
+        if index is not None:
+            files = index.files(cache_path)
+        else:
+            files = scan_files(cache_path, prune=policy.prune if policy else None)
+        if policy:
+            files = policy.filter(files)
+        if skip:
+            files = ((path, st) for path, st in files if (st.st_dev, st.st_ino) not in skip)
+        return files
+
+    # Whether every link of an inode is eligible is only known once the whole
+    # pool has been seen, i.e. after ranking. If incomplete groups were
+    # ranked, they took up part of the deficit; rank again without them so
+    # the plan still covers it (and a dry run shows what a real run moves).
+    links = {}
+    nlinks = {}
+    selected = rank(_first_links(eligible(None), links, nlinks), deficit, key)
+    incomplete = {inode for inode, paths in links.items() if len(paths) < nlinks[inode]}
+    ranked = [(path, st) for path, st in selected if (st.st_dev, st.st_ino) in incomplete]
+    for path, st in ranked:
+        paths = links[(st.st_dev, st.st_ino)]
+        syslog.syslog(
+            syslog.LOG_DEBUG,
+            f"Skipping {path}: {st.st_nlink - len(paths)} hard link(s) not eligible.",
+        )
+        metrics.count('skipped', len(paths))
+    if ranked:
+        pruned = policy.pruned if policy else 0
+        links = {}
+        selected = rank(_first_links(eligible(incomplete), links, {}), deficit, key)
+        if policy:
+            # The second pass prunes the same paths again.
+            policy.pruned = pruned
+
+    groups = []
+    for path, st in selected:
+        paths = links.get((st.st_dev, st.st_ino), [path]) if st.st_nlink > 1 else [path]
+        if len(paths) < st.st_nlink:
+            # Links changed between the two passes.
+            metrics.count('skipped', len(paths))
+            continue
+        groups.append((paths, st))
+    return groups
+
+
+def add_mover_arguments(parser):
+    """Options shared by uncache-mover.py and zfs-uncache-mover.py."""
+    parser.add_argument(
+        "--index",
+        dest="index",
+        nargs="?",
+        const=INDEX_DB,
+        default=None,
+        help=f"Use a persistent metadata index instead of walking the whole cache (default: {INDEX_DB}).",
+    )
+    parser.add_argument(
+        "--restat",
+        dest="restat",
+        action="store_true",
+        help="With --index, re-stat files even in directories whose mtime is unchanged.",
+    )
+    parser.add_argument(
+        "--compact",
+        dest="compact",
+        action="store_true",
+        help="Rank every file in a compact columnar table (faster with numpy) instead of a bounded heap; "
+        "best when a large part of the pool has to move.",
+    )
+    parser.add_argument(
+        "--policy",
+        dest="policy",
+        default=None,
+        help="Per-share eviction policy file (TOML, or JSON with a .json suffix).",
+    )
+    parser.add_argument(
+        "--order",
+        dest="order",
+        choices=["atime", "heat", "lru2", "gdsf", "size-age"],
+        default="atime",
+        help=(
+            "Eviction order: oldest atime first, coldest heat-tracker.py score first, "
+            "oldest second-to-last access (LRU-2), lowest access frequency per byte "
+            "(GreedyDual-Size-Frequency), or largest idle time x size."
+        ),
+    )
+    parser.add_argument(
+        "--heat-db",
+        dest="heat_db",
+        default=HEAT_DB,
+        help=f"Heat store written by heat-tracker.py (default: {HEAT_DB}).",
+    )
+    parser.add_argument(
+        "--backend",
+        dest="backend",
+        choices=sorted(MOVE_BACKENDS),
+        default="native",
+        help="Copy engine: in-process copy_file_range/sendfile, or one rsync per file.",
+    )
+    parser.add_argument(
+        "--skip-existing",
+        dest="skip_existing",
+        choices=SKIP_EXISTING,
+        default="stat",
+        help=(
+            "Native backend: when the destination already exists with the same size and "
+            "mtime, only remove the source ('hash' also compares sampled BLAKE2b hashes)."
+        ),
+    )
+    parser.add_argument(
+        "--checksum",
+        dest="checksum",
+        choices=sorted(CHECKSUMS),
+        default=None,
+        help=f"Native backend: hash data while copying it and store the digest in the {CHECKSUM_XATTR} xattr.",
+    )
+    parser.add_argument(
+        "--checksum-verify",
+        dest="checksum_verify",
+        action="store_true",
+        help="With --checksum, read each copy back from disk and compare before removing the source.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        default=1000,
+        type=int,
+        help="Files handed to a single rsync invocation via --files-from (rsync backend).",
+    )
+    parser.add_argument(
+        "--dry-run",
+        dest="dry_run",
+        action="store_true",
+        help="Only compute the eviction plan, write it out (see --plan-output) and exit.",
+    )
+    parser.add_argument(
+        "--plan-output",
+        dest="plan_output",
+        default="-",
+        help="Where --dry-run writes the plan (default: stdout).",
+    )
+    parser.add_argument(
+        "--plan-format",
+        dest="plan_format",
+        choices=["json", "csv"],
+        default="json",
+        help="Format of the --dry-run plan.",
+    )
+    parser.add_argument(
+        "--plan",
+        dest="plan",
+        default=None,
+        help="Execute a plan previously written with --dry-run instead of selecting candidates.",
+    )
+    parser.add_argument(
+        "--throttle",
+        dest="throttle",
+        action="store_true",
+        help="Run at idle I/O priority and pause while other processes read from the source or destination disks.",
+    )
+    parser.add_argument(
+        "--foreground-threshold",
+        dest="foreground_threshold",
+        default=1.0,
+        type=float,
+        help="With --throttle, foreign read rate (MiB/s) that pauses the mover.",
+    )
+    parser.add_argument(
+        "--bwlimit",
+        dest="bwlimit",
+        default=0,
+        type=float,
+        help="Total copy bandwidth cap in MiB/s (0 for unlimited).",
+    )
+    parser.add_argument(
+        "--ionice",
+        dest="ionice",
+        default=None,
+        help="I/O scheduling class as CLASS[:LEVEL], e.g. idle or best-effort:7 (default with --throttle: idle).",
+    )
+    parser.add_argument(
+        "--journal",
+        dest="journal",
+        default=JOURNAL,
+        help=f"Write-ahead journal used to recover and resume interrupted runs (default: {JOURNAL}).",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        dest="metrics_prom",
+        default=None,
+        help="Write run metrics to this Prometheus textfile-collector file (*.prom).",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        dest="metrics_json",
+        default=None,
+        help="Append run metrics as a JSON line to this file ('-' for stdout).",
+    )
+    parser.add_argument(
+        "--daemon",
+        dest="daemon",
+        action="store_true",
+        help="Keep running: poll usage and evict down to --target whenever it reaches --high.",
+    )
+    parser.add_argument(
+        "--high",
+        dest="high",
+        default=None,
+        type=float,
+        help="With --daemon, usage percentage that starts an eviction cycle (default: target + 10).",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        dest="poll_interval",
+        default=10,
+        type=float,
+        help="With --daemon, seconds between usage checks.",
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        default=STATUS_SOCKET,
+        help=f"With --daemon, Unix socket answering with a JSON status line (default: {STATUS_SOCKET}).",
+    )
+    parser.add_argument(
+        "--branches",
+        dest="branches",
+        default=None,
+        help="Write straight to these mergerfs branches (comma separated, or 'auto' to read them from the destination mount) with one worker per disk.",
+    )
+    parser.add_argument(
+        "--jobs",
+        dest="jobs",
+        default=0,
+        type=int,
+        help="With --branches, maximum number of files moved concurrently (default: one per disk).",
+    )
+
+
+def eviction_key(args, cache_path):
+    """Build the sort key selected by --order."""
+    if args.order == "atime":
+        return atime_key
+    heat = HeatStore(args.heat_db)
+    history = heat.history(cache_path)
+    heat.close()
+    syslog.syslog(syslog.LOG_INFO, f"Loaded access history for {len(history)} files.")
+    if args.order == "heat":
+        return heat_key({path: h[0] for path, h in history.items()})
+    if args.order == "lru2":
+        return lru2_key(history)
+    if args.order == "gdsf":
+        return gdsf_key(history, heat.half_life)
+    return size_age_key(history)
+
+
+def _subtree(path):
+    """Return (low, high) bounds selecting every path strictly below `path`."""
+    # '0' sorts right after '/', so this range is exactly the subtree.
+    return path + '/', path + '0'
+
+
+class CacheIndex:
+    """
+    Persistent SQLite index of the files living on the cache pool.
+
+    Directories whose mtime did not change since the previous refresh are not
+    listed again (their children are taken from the index), so a refresh on a
+    mostly idle pool costs one stat() per directory instead of one per file.
+    """
+
+    def __init__(self, db_path=INDEX_DB):
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime_ns INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                dir TEXT NOT NULL,
+                dev INTEGER,
+                ino INTEGER,
+                size INTEGER,
+                blocks INTEGER,
+                nlink INTEGER,
+                atime REAL,
+                mtime REAL
+            );
+            CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+            CREATE INDEX IF NOT EXISTS files_atime ON files(atime);
+            CREATE INDEX IF NOT EXISTS files_inode ON files(dev, ino);
+            """
+        )
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def _drop_tree(self, path):
+        low, high = _subtree(path)
+        self.db.execute(
+            "DELETE FROM dirs WHERE path = ? OR (path > ? AND path < ?)",
+            (path, low, high),
+        )
+        self.db.execute(
+            "DELETE FROM files WHERE path > ? AND path < ?", (low, high)
+        )
+
+    def refresh(self, root, restat=False, prune=None):
+        """
+        Bring the index for `root` up to date.
+
+        With `restat` every directory is listed and every file re-stat'ed,
+        which also picks up size/atime changes that do not touch the parent
+        directory mtime. Entries for which `prune(path)` is true are neither
+        listed nor indexed (and dropped if they were).
+
+        Returns the number of directories that had to be listed.
+        """
+        root = os.path.abspath(root)
+        listed = 0
+        stack = [(root, None)]
+        with self.db:
+            while stack:
+                directory, parent = stack.pop()
+                try:
+                    d_stat = os.stat(directory)
+                except OSError:
+                    self._drop_tree(directory)
+                    continue
+
+                row = self.db.execute(
+                    "SELECT mtime_ns FROM dirs WHERE path = ?", (directory,)
+                ).fetchone()
+                if not restat and row and row[0] == d_stat.st_mtime_ns:
+                    stack.extend(
+                        (r[0], directory)
+                        for r in self.db.execute(
+                            "SELECT path FROM dirs WHERE parent = ?", (directory,)
+                        )
+                    )
+                    continue
+
+                listed += 1
+                known_files = {
+                    r[0]
+                    for r in self.db.execute(
+                        "SELECT path FROM files WHERE dir = ?", (directory,)
+                    )
+                }
+                known_dirs = {
+                    r[0]
+                    for r in self.db.execute(
+                        "SELECT path FROM dirs WHERE parent = ?", (directory,)
+                    )
+                }
+                rows = []
+                subdirs = set()
+                try:
+                    with os.scandir(directory) as it:
+                        for entry in it:
+                            if prune and prune(entry.path):
+                                continue
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    subdirs.add(entry.path)
+                                elif entry.is_file(follow_symlinks=False):
+                                    st = entry.stat(follow_symlinks=False)
+                                    rows.append((
+                                        entry.path, directory, st.st_dev,
+                                        st.st_ino, st.st_size, st.st_blocks,
+                                        st.st_nlink, st.st_atime, st.st_mtime,
+                                    ))
+                            except OSError:
+                                continue
+                except OSError as e:
+                    syslog.syslog(syslog.LOG_WARNING, f"Unable to scan {directory}: {e}")
+                    continue
+
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self.db.executemany(
+                    "DELETE FROM files WHERE path = ?",
+                    ((p,) for p in known_files - {r[0] for r in rows}),
+                )
+                for gone in known_dirs - subdirs:
+                    self._drop_tree(gone)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                    (directory, parent, d_stat.st_mtime_ns),
+                )
+                stack.extend((d, directory) for d in subdirs)
+        return listed
+
+    def files(self, root, order_by='atime'):
+        """Yield (path, IndexedStat) for every indexed file below `root`."""
+        low, high = _subtree(os.path.abspath(root))
+        for row in self.db.execute(
+            "SELECT path, dev, ino, size, blocks, nlink, atime, mtime FROM files"
+            f" WHERE path > ? AND path < ? ORDER BY {order_by}",
+            (low, high),
+        ):
+            yield row[0], IndexedStat(*row[1:])
+
+    def links(self, root, dev, ino):
+        """Every indexed path below `root` sharing inode (dev, ino)."""
+        low, high = _subtree(os.path.abspath(root))
+        return [
+            r[0]
+            for r in self.db.execute(
+                "SELECT path FROM files WHERE dev = ? AND ino = ? AND path > ? AND path < ?",
+                (dev, ino, low, high),
+            )
+        ]
+
+    def coldest(self, root, deficit, prune=None):
+        """
+        Indexed equivalent of select_candidates(): walk files by ascending
+        atime until `deficit` bytes are covered, returning (paths, stat)
+        hard-link groups. `prune` (a never-move predicate matching a path or
+        any directory above it) also covers rows indexed before the rule
+        existed.
+        """
+        selected = []
+        seen = set()
+        total = 0
+        for path, st in self.files(root):
+            if total >= deficit:
+                break
+            if prune and prune(path):
+                continue
+            paths = [path]
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+                paths = self.links(root, st.st_dev, st.st_ino)
+                if len(paths) < st.st_nlink:
+                    continue
+            if prune and any(prune(p) for p in paths):
+                continue
+            selected.append((paths, st))
+            total += freed_bytes(st)
+        return selected
+
+    def forget(self, path):
+        """Drop a single file that has been moved off the cache."""
+        self.db.execute("DELETE FROM files WHERE path = ?", (os.fspath(path),))
+
+
+class HeatStore:
+    """
+    Decayed per-file access counts, written by heat-tracker.py.
+
+    Each row keeps the score as of `updated`; readers decay it to "now" with
+    the half-life stored alongside the data, so every consumer agrees on the
+    same temperature regardless of when the row was last touched. `updated`
+    and `previous` are the last two times the file was seen accessed, which
+    is the history LRU-2 needs.
+    """
+
+    def __init__(self, db_path=HEAT_DB, half_life=None):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS heat (
+                path TEXT PRIMARY KEY,
+                score REAL NOT NULL,
+                updated REAL NOT NULL,
+                previous REAL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(heat)")}
+        if 'previous' not in columns:
+            self.db.execute("ALTER TABLE heat ADD COLUMN previous REAL")
+        with self.db:
+            if half_life is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('half_life', ?)", (half_life,)
+                )
+            row = self.db.execute(
+                "SELECT value FROM meta WHERE key = 'half_life'"
+            ).fetchone()
+        self.half_life = float(row[0]) if row else HEAT_HALF_LIFE
+        self.db.create_function("decay", 2, self.decay, deterministic=True)
+
+    def decay(self, score, age):
+        return score * 0.5 ** (max(age, 0) / self.half_life)
+
+    def record(self, counts, now=None):
+        """Add `counts` ({path: accesses}) observed at `now`."""
+        now = time.time() if now is None else now
+        with self.db:
+            self.db.executemany(
+                """
+                INSERT INTO heat (path, score, updated) VALUES (?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    score = decay(score, excluded.updated - updated) + excluded.score,
+                    previous = updated,
+                    updated = excluded.updated
+                """,
+                ((path, count, now) for path, count in counts.items()),
+            )
+
+    def prune(self, floor=0.01, now=None):
+        """Forget files whose decayed score dropped below `floor`."""
+        now = time.time() if now is None else now
+        with self.db:
+            return self.db.execute(
+                "DELETE FROM heat WHERE decay(score, ? - updated) < ?", (now, floor)
+            ).rowcount
+
+    def scores(self, root, now=None):
+        """Return {path: decayed score} for every tracked file below `root`."""
+        now = time.time() if now is None else now
+        low, high = _subtree(os.path.abspath(root))
+        return {
+            path: self.decay(score, now - updated)
+            for path, score, updated in self.db.execute(
+                "SELECT path, score, updated FROM heat WHERE path > ? AND path < ?",
+                (low, high),
+            )
+        }
+
+    def history(self, root, now=None):
+        """
+        Return {path: (decayed score, last access, previous access)} for every
+        tracked file below `root`; previous is None after a single access.
+        """
+        now = time.time() if now is None else now
+        low, high = _subtree(os.path.abspath(root))
+        return {
+            path: (self.decay(score, now - updated), updated, previous)
+            for path, score, updated, previous in self.db.execute(
+                "SELECT path, score, updated, previous FROM heat WHERE path > ? AND path < ?",
+                (low, high),
+            )
+        }
+
+    def move(self, old, new):
+        """Carry a file's history over to its new path."""
+        with self.db:
+            self.db.execute(
+                "UPDATE OR REPLACE heat SET path = ? WHERE path = ?",
+                (os.fspath(new), os.fspath(old)),
+            )
+
+    def close(self):
+        self.db.close()
+
+
+def heat_key(scores):
+    """Eviction order by access heat; untracked files are coldest, then atime."""
+    return lambda path, st: (scores.get(path, 0.0), st.st_atime)
+
+
+def lru2_key(history):
+    """
+    LRU-2: evict by the time of the second most recent access, so a file
+    opened once (a scan, a single viewing) goes before one in regular use.
+    Files without heat history only have their atime, i.e. one access.
+    """
+    def key(path, st):
+        h = history.get(path)
+        if h is None:
+            return (0.0, st.st_atime)
+        _, last, previous = h
+        return (previous or 0.0, max(last, st.st_atime))
+    return key
+
+
+def _frequency(history, half_life, now):
+    """Decayed access count; an untracked file counts its atime as one access."""
+    def frequency(path, st):
+        h = history.get(path)
+        if h is not None:
+            return h[0]
+        return 0.5 ** (max(now - st.st_atime, 0) / half_life)
+    return frequency
+
+
+def gdsf_key(history, half_life, now=None):
+    """
+    GreedyDual-Size-Frequency: value = frequency / size, lowest evicted
+    first. Moving one large, rarely used file frees as much as thousands of
+    small ones while costing far fewer cache hits. The decay of the access
+    counts plays the part of GDSF's inflation value, ageing old hits out.
+    """
+    frequency = _frequency(history, half_life, time.time() if now is None else now)
+    return lambda path, st: frequency(path, st) / max(freed_bytes(st), 4096)
+
+
+def size_age_key(history, now=None):
+    """
+    Size-weighted age: the larger and longer unused a file is, the earlier it
+    goes (key = -idle seconds x allocated bytes).
+    """
+    now = time.time() if now is None else now
+
+    def key(path, st):
+        h = history.get(path)
+        last = max(h[1], st.st_atime) if h is not None else st.st_atime
+        return -max(now - last, 0) * freed_bytes(st)
+    return key
+
+
+class Metrics:
+    """
+    Counters and per-phase timings of a mover run, exported as a Prometheus
+    textfile-collector file and/or appended as a JSON line.
+
+    Phases: scan (directory listing, or index refresh), stat, plan
+    (selection), copy, verify and unlink. Copy-side phases are summed over
+    worker threads, so with several disks they can exceed the wall time
+    recorded as `move`.
+    """
+
+    PHASES = ('scan', 'stat', 'plan', 'copy', 'verify', 'unlink', 'move')
+    COUNTS = ('moved', 'failed', 'skipped', 'missing', 'deduplicated')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.phases = dict.fromkeys(self.PHASES, 0.0)
+            self.files = dict.fromkeys(self.COUNTS, 0)
+            self.bytes_moved = 0
+            self.capacity = {}
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] += seconds
+
+    def timed(self, phase):
+        return _Timed(self, phase)
+
+    def count(self, result, files=1, nbytes=0):
+        with self.lock:
+            self.files[result] += files
+            if result == 'moved':
+                self.bytes_moved += nbytes
+
+    def set_capacity(self, when, used, total):
+        self.capacity[when] = used
+        self.capacity['total'] = total
+
+    def snapshot(self):
+        with self.lock:
+            move = self.phases['move']
+            return {
+                'started': self.started,
+                'duration': time.time() - self.started,
+                'phases': dict(self.phases),
+                'files': dict(self.files),
+                'bytes_moved': self.bytes_moved,
+                'bytes_per_second': self.bytes_moved / move if move else 0.0,
+                'files_per_second': self.files['moved'] / move if move else 0.0,
+                'capacity': dict(self.capacity),
+            }
+
+    def write_prometheus(self, path, labels):
+        """Write the textfile-collector file atomically (node_exporter may read it any time)."""
+        snap = self.snapshot()
+        base = ",".join(f'{k}="{v}"' for k, v in labels.items())
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP uncache_mover_{name} {help_text}")
+            lines.append(f"# TYPE uncache_mover_{name} {kind}")
+            for extra, value in samples:
+                label = ",".join(filter(None, [base, extra]))
+                lines.append(f"uncache_mover_{name}{{{label}}} {value}")
+
+        metric("phase_seconds", "gauge", "Time spent per phase in the last run.",
+               [(f'phase="{k}"', v) for k, v in snap['phases'].items()])
+        metric("files", "gauge", "Files by outcome in the last run.",
+               [(f'result="{k}"', v) for k, v in snap['files'].items()])
+        metric("moved_bytes", "gauge", "Bytes freed on the cache in the last run.",
+               [("", snap['bytes_moved'])])
+        metric("bytes_per_second", "gauge", "Move throughput of the last run.",
+               [("", snap['bytes_per_second'])])
+        metric("files_per_second", "gauge", "Files moved per second in the last run.",
+               [("", snap['files_per_second'])])
+        metric("capacity_used_bytes", "gauge", "Cache usage before and after the last run.",
+               [(f'when="{k}"', v) for k, v in snap['capacity'].items() if k != 'total'])
+        if 'total' in snap['capacity']:
+            metric("capacity_total_bytes", "gauge", "Cache size.",
+                   [("", snap['capacity']['total'])])
+        metric("duration_seconds", "gauge", "Wall time of the last run.",
+               [("", snap['duration'])])
+        metric("last_run_timestamp_seconds", "gauge", "When the last run ended.",
+               [("", time.time())])
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(prefix=".uncache-mover.", dir=directory)
+        with os.fdopen(fd, "w") as file:
+            file.write("\n".join(lines) + "\n")
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+
+    def write_json(self, path, labels):
+        """Append the run as one JSON line ('-' for stdout)."""
+        line = json.dumps(dict(labels, **self.snapshot())) + "\n"
+        if path == "-":
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            return
+        with open(path, "a") as file:
+            file.write(line)
+
+    def export(self, args, labels):
+        """Write whatever --metrics-prom / --metrics-json asked for."""
+        try:
+            if args.metrics_prom:
+                self.write_prometheus(args.metrics_prom, labels)
+            if args.metrics_json:
+                self.write_json(args.metrics_json, labels)
+        except OSError as e:
+            syslog.syslog(syslog.LOG_WARNING, f"Unable to write metrics: {e}")
+
+
+class _Timed:
+    __slots__ = ('metrics', 'phase', 't_start')
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.phase, time.perf_counter() - self.t_start)
+
+
+metrics = Metrics()
+
+
+# ioprio_set(2); not exposed by the os module.
+IOPRIO_SYSCALL = {'x86_64': 251, 'aarch64': 30, 'armv7l': 314, 'i686': 289}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+THROTTLE_CHUNK = 8 * 1024 * 1024
+
+
+def set_ioprio(spec):
+    """
+    Apply an I/O scheduling class to this process, like ionice(1).
+
+    `spec` is CLASS[:LEVEL], e.g. "idle" or "best-effort:7". It is inherited
+    by threads and rsync children started afterwards.
+    """
+    name, _, level = spec.partition(':')
+    if name not in IOPRIO_CLASSES:
+        raise ValueError(f"Unknown I/O class {name}; use one of {', '.join(IOPRIO_CLASSES)}.")
+    nr = IOPRIO_SYSCALL.get(platform.machine())
+    if nr is None:
+        syslog.syslog(syslog.LOG_WARNING, f"ioprio_set unknown on {platform.machine()}; not applied.")
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    value = (IOPRIO_CLASSES[name] << IOPRIO_CLASS_SHIFT) | int(level or 0)
+    if libc.syscall(nr, IOPRIO_WHO_PROCESS, 0, value) < 0:
+        err = ctypes.get_errno()
+        syslog.syslog(syslog.LOG_WARNING, f"ioprio_set failed: {os.strerror(err)}")
+
+
+def block_devices(paths):
+    """/proc/diskstats names of the whole disks behind `paths`, when known."""
+    devices = set()
+    for path in paths:
+        name = spindle(path)
+        if os.path.exists(f"/sys/block/{name}"):
+            devices.add(name)
+        else:
+            syslog.syslog(
+                syslog.LOG_WARNING, f"No block device found for {path}; not watched."
+            )
+    return devices
+
+
+def _children(pid):
+    """Direct children of `pid` (needs CONFIG_PROC_CHILDREN; empty otherwise)."""
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as file:
+                children.extend(file.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _own_read_bytes(spawned=()):
+    """
+    Bytes read from storage by this process and its unreaped descendants.
+
+    The kernel folds a child's I/O counters into its parent's when the
+    child is reaped, so /proc/self/io already covers reaped children; the
+    live (or zombie) ones are added from their own counters. `spawned`
+    lists the children started by the mover, for kernels without
+    /proc/PID/task/TID/children.
+    """
+    pids = []
+    stack = list(dict.fromkeys(_children('self') + [str(p) for p in spawned]))
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(_children(pid))
+    total = 0
+    # Children first: one reaped meanwhile (e.g. by rsync itself) is then
+    # found in its parent's counters read afterwards.
+    for pid in pids[::-1] + ['self']:
+        try:
+            with open(f"/proc/{pid}/io") as file:
+                for line in file:
+                    if line.startswith('read_bytes:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+
+def _wait_exited(pid, timeout):
+    """Wait up to `timeout` seconds for `pid` to exit, without reaping it."""
+    deadline = time.monotonic() + timeout
+    delay = 0.0005
+    while os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT | os.WNOHANG) is None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        delay = min(delay * 2, remaining, 0.05)
+        time.sleep(delay)
+    return True
+
+
+class Throttle:
+    """
+    Keeps the mover out of the way of foreground I/O (e.g. Plex streams).
+
+    `bwlimit` caps copy bandwidth in bytes/s across all workers. With
+    `threshold` set, /proc/diskstats is sampled for the source and
+    destination disks; reads that this process did not issue are treated
+    as foreground load and the mover pauses until they drop below
+    `threshold` bytes/s.
+    """
+
+    def __init__(self, bwlimit=0, devices=(), threshold=0, interval=1.0):
+        self.bwlimit = bwlimit
+        self.devices = set(devices)
+        self.threshold = threshold
+        self.interval = interval
+        self.workers = 1
+        self.lock = threading.Lock()
+        self.allowance = 0
+        self.last_refill = time.monotonic()
+        self.sample = None
+        self.foreground = False
+        self.spawned = set()
+
+    @property
+    def active(self):
+        return bool(self.bwlimit or (self.threshold and self.devices))
+
+    def _device_reads(self):
+        total = 0
+        with open('/proc/diskstats') as file:
+            for line in file:
+                fields = line.split()
+                if fields[2] in self.devices:
+                    total += int(fields[5]) * 512
+        return total
+
+    def busy(self):
+        """True while foreground reads exceed the threshold."""
+        if not (self.threshold and self.devices):
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if self.sample and now - self.sample[0] < self.interval:
+                return self.foreground
+            reads, own = self._device_reads(), _own_read_bytes(self.spawned)
+            if self.sample:
+                elapsed = now - self.sample[0]
+                foreign = (reads - self.sample[1]) - (own - self.sample[2])
+                busy = foreign / elapsed > self.threshold
+                if busy != self.foreground:
+                    syslog.syslog(
+                        syslog.LOG_INFO,
+                        "Foreground I/O detected; pausing." if busy else "Foreground I/O gone; resuming.",
+                    )
+                self.foreground = busy
+            self.sample = (now, reads, own)
+            return self.foreground
+
+    def spawn(self, cmd):
+        """Start a copy process whose reads count as the mover's own."""
+        with self.lock:
+            proc = subprocess.Popen(cmd)
+            self.spawned.add(proc.pid)
+        return proc
+
+    def reap(self, proc):
+        """
+        Reap an exited copy process. Its I/O moves into this process's
+        counters at that moment, so it is done under the sampling lock:
+        otherwise a sample could see it in neither place and count its
+        reads as foreground load.
+        """
+        with self.lock:
+            proc.wait()
+            self.spawned.discard(proc.pid)
+
+    def wait_idle(self):
+        """Block while foreground I/O is present."""
+        while self.busy():
+            time.sleep(self.interval)
+
+    def consume(self, nbytes):
+        """Account for `nbytes` copied; sleeps to honour the bandwidth cap."""
+        self.wait_idle()
+        if not self.bwlimit:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(
+                self.allowance + (now - self.last_refill) * self.bwlimit, self.bwlimit
+            )
+            self.last_refill = now
+            self.allowance -= nbytes
+            delay = -self.allowance / self.bwlimit if self.allowance < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def rsync_args(self):
+        """Split the bandwidth cap between concurrent rsync processes."""
+        if not self.bwlimit:
+            return []
+        return [f"--bwlimit={max(1, int(self.bwlimit / 1024 / self.workers))}"]
+
+
+throttle = Throttle()
+
+
+def setup_throttle(args, paths):
+    """Configure the module throttle and I/O class from the mover options."""
+    global throttle
+    ionice = args.ionice or ("idle" if args.throttle else None)
+    if ionice:
+        set_ioprio(ionice)
+    devices = block_devices(paths) if args.throttle else set()
+    throttle = Throttle(
+        bwlimit=args.bwlimit * 1024 * 1024,
+        devices=devices,
+        threshold=args.foreground_threshold * 1024 * 1024 if args.throttle else 0,
+    )
+    if throttle.active:
+        syslog.syslog(
+            syslog.LOG_INFO,
+            f"Throttling: bwlimit {args.bwlimit} MiB/s, watching {', '.join(sorted(devices)) or 'no devices'}.",
+        )
+
+
+# Rsync options
+# -a, --archive               archive mode; equals -rlptgoD (no -H,-A,-X)
+# -x, --one-file-system       don't cross filesystem boundaries
+# -q, --quiet                 suppress non-error messages
+# -H, --hard-links            preserve hard links
+# -A, --acls                  preserve ACLs (implies --perms)
+# -X, --xattrs                preserve extended attributes
+# -W, --whole-file            copy files whole (without delta-xfer algorithm)
+# -E, --executability         preserve the file's executability
+# -S, --sparse                turn sequences of nulls into sparse blocks
+# -R, --relative              use relative path names
+# --preallocate               allocate dest files before writing them
+# --remove-source-files       sender removes synchronized files (non-dirs)
+RSYNC_CMD = ["rsync", "-axqHAXWESR", "--preallocate", "--remove-source-files"]
+
+
+def rsync_move(batch, cache_path):
+    """
+    Move a batch of (paths, stat, dest) groups with one rsync per destination,
+    fed through --files-from so that -H can keep hard links together.
+
+    Returns one success flag per group: a group succeeded when none of its
+    source paths is left on the cache.
+    """
+    by_dest = {}
+    for group in batch:
+        by_dest.setdefault(group[2], []).append(group)
+    for dest, groups in by_dest.items():
+        with tempfile.NamedTemporaryFile("wb", prefix="uncache-mover.", suffix=".files") as f:
+            for paths, _, _ in groups:
+                for path in paths:
+                    f.write(os.fsencode(os.path.relpath(path, cache_path)) + b"\0")
+            f.flush()
+            throttle.wait_idle()
+            t_copy = time.perf_counter()
+            proc = throttle.spawn(
+                RSYNC_CMD
+                + throttle.rsync_args()
+                + ["--from0", f"--files-from={f.name}", f"{cache_path}/", f"{dest}/"]
+            )
+            stopped = False
+            while not _wait_exited(proc.pid, throttle.interval):
+                # Freeze rsync mid-batch while someone else needs the disks.
+                busy = throttle.busy()
+                if busy != stopped:
+                    proc.send_signal(signal.SIGSTOP if busy else signal.SIGCONT)
+                    stopped = busy
+            throttle.reap(proc)
+            # rsync copies and unlinks in one go.
+            metrics.add('copy', time.perf_counter() - t_copy)
+    with metrics.timed('verify'):
+        return [
+            not any(os.path.lexists(path) for path in paths) for paths, _, _ in batch
+        ]
+
+
+_copy_file_range_ok = hasattr(os, 'copy_file_range')
+
+
+def _copy_extent(fd_in, fd_out, offset, count):
+    """Copy [offset, offset + count) at the same offset in fd_out."""
+    global _copy_file_range_ok
+    end = offset + count
+    chunk = THROTTLE_CHUNK if throttle.active else end
+    while offset < end and _copy_file_range_ok:
+        try:
+            n = os.copy_file_range(fd_in, fd_out, min(end - offset, chunk), offset, offset)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+            # Not supported between these filesystems (e.g. into FUSE).
+            _copy_file_range_ok = False
+            break
+        if n == 0:
+            return
+        offset += n
+        if throttle.active:
+            throttle.consume(n)
+    if offset < end:
+        os.lseek(fd_out, offset, os.SEEK_SET)
+    while offset < end:
+        n = os.sendfile(fd_out, fd_in, offset, min(end - offset, chunk))
+        if n == 0:
+            return
+        offset += n
+        if throttle.active:
+            throttle.consume(n)
+
+
+_ZEROS = bytes(THROTTLE_CHUNK)
+
+
+def _hash_zeros(h, count):
+    """Feed `count` zero bytes (a hole) to hash `h` without reading anything."""
+    zeros = memoryview(_ZEROS)
+    while count > 0:
+        n = min(count, len(zeros))
+        h.update(zeros[:n])
+        count -= n
+
+
+def _copy_extent_hashed(fd_in, fd_out, offset, count, h):
+    """_copy_extent() through a userspace buffer, hashing the data on the way."""
+    end = offset + count
+    while offset < end:
+        buf = os.pread(fd_in, min(end - offset, THROTTLE_CHUNK), offset)
+        if not buf:
+            return
+        h.update(buf)
+        view = memoryview(buf)
+        while view:
+            n = os.pwrite(fd_out, view, offset)
+            view = view[n:]
+            offset += n
+        if throttle.active:
+            throttle.consume(len(buf))
+
+
+def _copy_data(fd_in, fd_out, size, h=None):
+    """
+    Copy file contents, skipping holes found with SEEK_DATA/SEEK_HOLE. With
+    a hash object `h`, data is copied through userspace and hashed in the
+    same pass (holes count as zeros), instead of in-kernel.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            data = os.lseek(fd_in, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                break  # Only a hole left.
+            if e.errno != errno.EINVAL:
+                raise
+            # Filesystem without SEEK_DATA support: copy densely.
+            data, hole = offset, size
+        else:
+            hole = os.lseek(fd_in, data, os.SEEK_HOLE)
+        if h is None:
+            _copy_extent(fd_in, fd_out, data, min(hole, size) - data)
+        else:
+            _hash_zeros(h, data - offset)
+            _copy_extent_hashed(fd_in, fd_out, data, min(hole, size) - data, h)
+        offset = hole
+    if h is not None and offset < size:
+        _hash_zeros(h, size - offset)
+    os.ftruncate(fd_out, size)
+
+
+def _copy_xattrs(src, fd_out):
+    """Copy every xattr (including POSIX ACLs stored as system.posix_acl_*)."""
+    try:
+        names = os.listxattr(src, follow_symlinks=False)
+    except OSError as e:
+        if e.errno in (errno.ENOTSUP, errno.EOPNOTSUPP):
+            return
+        raise
+    for name in names:
+        os.setxattr(fd_out, name, os.getxattr(src, name, follow_symlinks=False))
+
+
+def _copy_metadata(src, st, fd_out):
+    """Owner, mode, xattrs/ACLs; chown first since it can clear setuid bits."""
+    os.fchown(fd_out, st.st_uid, st.st_gid)
+    os.fchmod(fd_out, stat.S_IMODE(st.st_mode))
+    _copy_xattrs(src, fd_out)
+
+
+def make_parents(rel_dir, cache_path, slow_path):
+    """Create missing destination directories, mirroring the cache's owner/mode."""
+    src_dir = os.path.join(cache_path, rel_dir)
+    dst_dir = os.path.join(slow_path, rel_dir)
+    if os.path.isdir(dst_dir):
+        return dst_dir
+    parts = [p for p in rel_dir.split(os.sep) if p]
+    for i in range(1, len(parts) + 1):
+        d = os.path.join(slow_path, *parts[:i])
+        if os.path.isdir(d):
+            continue
+        d_stat = os.stat(os.path.join(cache_path, *parts[:i]))
+        try:
+            os.mkdir(d, stat.S_IMODE(d_stat.st_mode))
+        except FileExistsError:
+            continue
+        os.chown(d, d_stat.st_uid, d_stat.st_gid)
+        os.chmod(d, stat.S_IMODE(d_stat.st_mode))
+    return dst_dir
+
+
+# How native_move() treats a destination that already exists: "off" always
+# copies, "stat" trusts a matching size and mtime (like rsync's quick check),
+# "hash" also compares quick_hash() of both files.
+SKIP_EXISTING = ("off", "stat", "hash")
+skip_existing = "stat"
+QUICK_HASH_CHUNK = 1024 * 1024
+
+
+# Integrity record written by the native engine with --checksum:
+# "<algorithm>:<hex digest>:<mtime_ns>" of the whole logical file.
+CHECKSUM_XATTR = 'user.uncache.checksum'
+CHECKSUMS = {'blake2b': lambda: hashlib.blake2b(digest_size=32)}
+if xxhash is not None:
+    CHECKSUMS['xxh3'] = xxhash.xxh3_128
+checksum = None
+checksum_verify = False
+
+
+def setup_engine(args):
+    """Apply the --skip-existing and --checksum choices to the native engine."""
+    global skip_existing, checksum, checksum_verify
+    skip_existing = args.skip_existing
+    checksum = getattr(args, 'checksum', None)
+    checksum_verify = getattr(args, 'checksum_verify', False)
+
+
+def hash_file(fd, size, algorithm):
+    """Digest of the whole file, holes included, as stored in CHECKSUM_XATTR."""
+    h = CHECKSUMS[algorithm]()
+    offset = 0
+    while offset < size:
+        buf = os.pread(fd, THROTTLE_CHUNK, offset)
+        if not buf:
+            break
+        h.update(buf)
+        offset += len(buf)
+    return h.hexdigest()
+
+
+def read_checksum(path):
+    """Return (algorithm, digest, mtime_ns) stored on `path`, or None."""
+    try:
+        value = os.getxattr(path, CHECKSUM_XATTR, follow_symlinks=False).decode()
+        algorithm, digest, mtime_ns = value.split(':')
+        return algorithm, digest, int(mtime_ns)
+    except (OSError, ValueError):
+        return None
+
+
+def _store_checksum(fd_out, h, st):
+    """Record the digest on the copy; after a fresh read-back with --checksum-verify."""
+    digest = h.hexdigest()
+    if checksum_verify:
+        with metrics.timed('verify'):
+            # Force the copy out and read it back from disk, not the page cache.
+            os.fdatasync(fd_out)
+            os.posix_fadvise(fd_out, 0, 0, os.POSIX_FADV_DONTNEED)
+            if hash_file(fd_out, st.st_size, checksum) != digest:
+                raise OSError(errno.EIO, "checksum mismatch reading back the copy")
+    try:
+        os.setxattr(fd_out, CHECKSUM_XATTR, f"{checksum}:{digest}:{st.st_mtime_ns}".encode())
+    except OSError as e:
+        if e.errno not in (errno.ENOTSUP, errno.EOPNOTSUPP):
+            raise
+        syslog.syslog(syslog.LOG_WARNING, f"Destination does not support user xattrs: {e}")
+
+
+def quick_hash(fd, size):
+    """
+    BLAKE2b of the size and three 1MiB samples (start, middle, end): enough
+    to tell a complete copy from a truncated or different file without
+    reading multi-GB files in full. Small files are hashed entirely.
+    """
+    h = hashlib.blake2b(str(size).encode(), digest_size=16)
+    if size <= 3 * QUICK_HASH_CHUNK:
+        offsets = range(0, size, QUICK_HASH_CHUNK)
+    else:
+        offsets = (0, size // 2, size - QUICK_HASH_CHUNK)
+    for offset in offsets:
+        h.update(os.pread(fd, QUICK_HASH_CHUNK, offset))
+    return h.digest()
+
+
+def _same_file(fd_in, st, dst):
+    """True when `dst` already holds the data of the open source file."""
+    try:
+        d_st = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    if not stat.S_ISREG(d_st.st_mode):
+        return False
+    if (d_st.st_size, d_st.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+        return False
+    if skip_existing != "hash":
+        return True
+    fd_dst = os.open(dst, os.O_RDONLY | os.O_NOFOLLOW)
+    try:
+        return quick_hash(fd_dst, d_st.st_size) == quick_hash(fd_in, st.st_size)
+    finally:
+        os.close(fd_dst)
+
+
+def _adopt(c_path, st, dst):
+    """Bring owner, mode, xattrs and times of an existing copy in line with the source."""
+    fd = os.open(dst, os.O_RDONLY | os.O_NOFOLLOW)
+    try:
+        _copy_metadata(c_path, st, fd)
+        os.utime(fd, ns=(st.st_atime_ns, st.st_mtime_ns))
+    finally:
+        os.close(fd)
+
+
+def native_move(c_path, cache_path, slow_path):
+    """
+    Move one file without forking rsync; returns True on success.
+
+    Data goes through copy_file_range() (sendfile() when the kernel refuses,
+    e.g. into a FUSE mount) and holes are preserved with SEEK_DATA/SEEK_HOLE.
+    Owner, mode, xattrs, ACLs and timestamps are copied. The file is written
+    to a temporary name next to the destination and renamed into place; like
+    rsync --remove-source-files, the source is only unlinked once the copy is
+    complete and the source did not change while it was being read.
+
+    When the destination already holds the file (a previous interrupted
+    run, a mergerfs fallback write), it is verified as per `skip_existing`
+    and only the source is removed.
+    """
+    rel = os.path.relpath(c_path, cache_path)
+    tmp = None
+    try:
+        dst_dir = make_parents(os.path.dirname(rel), cache_path, slow_path)
+        dst = os.path.join(slow_path, rel)
+        fd_in = os.open(c_path, os.O_RDONLY | os.O_NOFOLLOW)
+        try:
+            st = os.fstat(fd_in)
+            if skip_existing != "off":
+                with metrics.timed('verify'):
+                    same = _same_file(fd_in, st, dst)
+                if same:
+                    _adopt(c_path, st, dst)
+                    with metrics.timed('unlink'):
+                        os.unlink(c_path)
+                    metrics.count('deduplicated')
+                    syslog.syslog(syslog.LOG_DEBUG, f"{dst} already up to date; removed {c_path}.")
+                    return True
+            fd_out, tmp = tempfile.mkstemp(
+                prefix=_tmp_prefix(os.path.basename(rel)), suffix=TMP_SUFFIX, dir=dst_dir
+            )
+            try:
+                if st.st_blocks * 512 >= st.st_size:
+                    # Dense file: preallocate like rsync --preallocate.
+                    try:
+                        os.posix_fallocate(fd_out, 0, st.st_size)
+                    except OSError:
+                        pass
+                h = CHECKSUMS[checksum]() if checksum else None
+                with metrics.timed('copy'):
+                    _copy_data(fd_in, fd_out, st.st_size, h)
+                    _copy_metadata(c_path, st, fd_out)
+                if h is not None:
+                    _store_checksum(fd_out, h, st)
+                os.utime(fd_out, ns=(st.st_atime_ns, st.st_mtime_ns))
+                written = os.fstat(fd_out).st_size
+            finally:
+                os.close(fd_out)
+            after = os.fstat(fd_in)
+        finally:
+            os.close(fd_in)
+
+        with metrics.timed('verify'):
+            if written != st.st_size:
+                raise OSError(errno.EIO, f"short copy ({written} of {st.st_size} bytes)")
+            if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+                raise OSError(errno.EAGAIN, "source changed during copy")
+            os.rename(tmp, dst)
+            tmp = None
+        with metrics.timed('unlink'):
+            os.unlink(c_path)
+        return True
+    except OSError as e:
+        syslog.syslog(syslog.LOG_ERR, f"Failed to move {c_path}: {e}")
+        if tmp:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        return False
+
+
+def _tmp_prefix(name):
+    """
+    Return the `.name.` prefix of a temporary file for `name`, cut at a
+    character boundary so the whole temporary name still fits in NAME_MAX.
+    """
+    # Leave room for the two dots, mkstemp's random part or a PID, and TMP_SUFFIX.
+    room = 255 - 2 - 16 - len(TMP_SUFFIX)
+    raw = os.fsencode(name)
+    if len(raw) > room:
+        end = room
+        while end > 0 and raw[end] & 0xC0 == 0x80:
+            end -= 1
+        name = os.fsdecode(raw[:end])
+    return f".{name}."
+
+
+def _link_into(first_dst, c_path, st, cache_path, slow_path):
+    """Recreate hard link `c_path` next to an already moved `first_dst`."""
+    rel = os.path.relpath(c_path, cache_path)
+    dst_dir = make_parents(os.path.dirname(rel), cache_path, slow_path)
+    tmp = os.path.join(dst_dir, f"{_tmp_prefix(os.path.basename(rel))}{os.getpid()}{TMP_SUFFIX}")
+    os.link(first_dst, tmp)
+    try:
+        current = os.lstat(c_path)
+        if (current.st_dev, current.st_ino) != (st.st_dev, st.st_ino):
+            raise OSError(errno.EAGAIN, "source was replaced")
+        os.rename(tmp, os.path.join(slow_path, rel))
+    except OSError:
+        os.unlink(tmp)
+        raise
+    os.unlink(c_path)
+
+
+def native_move_group(paths, st, cache_path, slow_path):
+    """
+    Move all hard links of one inode: the data is copied once and the other
+    names are linked to it on the destination. If linking is refused (e.g.
+    mergerfs placed the directories on different branches) that name falls
+    back to a full copy so the move still completes.
+    """
+    first, others = paths[0], paths[1:]
+    if not native_move(first, cache_path, slow_path):
+        return False
+    first_dst = os.path.join(slow_path, os.path.relpath(first, cache_path))
+    ok = True
+    for c_path in others:
+        try:
+            _link_into(first_dst, c_path, st, cache_path, slow_path)
+        except OSError as e:
+            syslog.syslog(
+                syslog.LOG_WARNING, f"Unable to hard link {c_path} ({e}); copying instead."
+            )
+            ok = native_move(c_path, cache_path, slow_path) and ok
+    return ok
+
+
+def native_move_batch(batch, cache_path):
+    """Move (paths, stat, dest) groups one at a time with the native engine."""
+    return [native_move_group(paths, st, cache_path, dest) for paths, st, dest in batch]
+
+
+MOVE_BACKENDS = {
+    "native": native_move_batch,
+    "rsync": rsync_move,
+}
+
+
+def select_promotions(history, roots, cache_path, headroom, min_heat):
+    """
+    Pick the hottest files under `roots` (the slow pool and/or its branches)
+    worth bringing back to the cache: at least `min_heat` decayed accesses,
+    not already on the cache, and fitting in `headroom` bytes together.
+
+    `history` is HeatStore.history() output; returns (path, root, stat, last
+    access) tuples, hottest first. Hard-linked files are left alone since
+    moving one name would split the group.
+    """
+    roots = [os.path.abspath(r) for r in roots]
+    picked = []
+    total = 0
+    for path, (score, last, _) in sorted(history.items(), key=lambda h: -h[1][0]):
+        if score < min_heat:
+            break
+        root = next((r for r in roots if path.startswith(r + '/')), None)
+        if root is None:
+            continue
+        if os.path.lexists(os.path.join(cache_path, os.path.relpath(path, root))):
+            continue
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode) or st.st_nlink > 1:
+            continue
+        if total + freed_bytes(st) > headroom:
+            continue
+        total += freed_bytes(st)
+        picked.append((path, root, st, last))
+    return picked
+
+
+def promote(picked, cache_path, heat=None):
+    """
+    Move select_promotions() picks back into `cache_path` with the native
+    engine, the slow root acting as the source tree. The cache copy gets the
+    last observed access as its atime, and its heat history follows it, so
+    the next demotion pass does not send it straight back.
+
+    Returns the list of promoted cache paths.
+    """
+    promoted = []
+    for path, root, st, last in picked:
+        throttle.wait_idle()
+        if not native_move(path, root, cache_path):
+            continue
+        dst = os.path.join(cache_path, os.path.relpath(path, root))
+        atime_ns = max(int(last * 1e9), st.st_atime_ns)
+        try:
+            os.utime(dst, ns=(atime_ns, st.st_mtime_ns), follow_symlinks=False)
+        except OSError:
+            pass
+        if heat is not None:
+            heat.move(path, dst)
+        syslog.syslog(syslog.LOG_DEBUG, f"Promoted {path} -> {dst}")
+        promoted.append(dst)
+    return promoted
+
+
+def mergerfs_branches(mount):
+    """Return the branch paths of a mergerfs mount, or [] if it is not one."""
+    try:
+        raw = os.getxattr(os.path.join(mount, '.mergerfs'), 'user.mergerfs.srcmounts')
+    except OSError:
+        return []
+    # Branches may carry a mode suffix, e.g. /mnt/disk1=RW.
+    return [b.split('=')[0] for b in os.fsdecode(raw).split(':') if b]
+
+
+def resolve_branches(spec, slow_path):
+    """Turn the --branches option into a list of directories."""
+    if spec is None:
+        return []
+    if spec == 'auto':
+        branches = mergerfs_branches(slow_path)
+        if not branches:
+            raise ValueError(f"{slow_path} does not look like a mergerfs mount.")
+    else:
+        branches = [b for b in spec.split(',') if b]
+    for b in branches:
+        if not os.path.isdir(b):
+            raise NotADirectoryError(f"{b} is not a valid directory.")
+    return branches
+
+
+def spindle(path):
+    """Name of the whole disk backing `path` (e.g. 'sdb'), best effort."""
+    dev = os.stat(path).st_dev
+    try:
+        real = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+        if os.path.exists(os.path.join(real, 'partition')):
+            real = os.path.dirname(real)
+        return os.path.basename(real)
+    except OSError:
+        return str(dev)
+
+
+def assign_branches(candidates, cache_path, branches):
+    """
+    Decide which branch each candidate group lands on and group them per disk.
+
+    A branch that already holds the file (from an interrupted run, an rsync
+    fallback or a skip-existing candidate) always wins, so a retry never
+    leaves a second copy on another disk under the same mergerfs path.
+    Otherwise, like mergerfs' epmfs policy: prefer branches that already
+    hold the parent directory, then the one with the most free space. Free
+    space is tracked in memory as files are assigned so the load spreads
+    across disks. All hard links of a group go to the same branch.
+
+    Returns {disk: [(paths, stat, branch), ...]} preserving candidate order.
+    """
+    free = {}
+    for b in branches:
+        vfs = os.statvfs(b)
+        free[b] = vfs.f_bavail * vfs.f_frsize
+    disks = {b: spindle(b) for b in branches}
+    has_dir = {}
+    queues = {}
+    for paths, c_stat in candidates:
+        rels = [os.path.relpath(p, cache_path) for p in paths]
+        holding = [b for b in branches if any(os.path.lexists(os.path.join(b, r)) for r in rels)]
+        if holding:
+            if len(holding) > 1:
+                syslog.syslog(
+                    syslog.LOG_WARNING, f"{rels[0]} already exists on {', '.join(holding)}."
+                )
+            branch = holding[0]
+            try:
+                free[branch] -= max(0, c_stat.st_size - os.lstat(os.path.join(branch, rels[0])).st_size)
+            except OSError:
+                free[branch] -= c_stat.st_size
+            queues.setdefault(disks[branch], []).append((paths, c_stat, branch))
+            continue
+        parent = os.path.dirname(rels[0])
+        existing = has_dir.get(parent)
+        if existing is None:
+            existing = [b for b in branches if os.path.isdir(os.path.join(b, parent))]
+            has_dir[parent] = existing
+        pool = [b for b in (existing or branches) if free[b] > c_stat.st_size]
+        if not pool:
+            pool = [b for b in branches if free[b] > c_stat.st_size]
+        if not pool:
+            syslog.syslog(syslog.LOG_WARNING, f"No branch has room for {paths[0]}.")
+            continue
+        branch = max(pool, key=free.get)
+        free[branch] -= c_stat.st_size
+        queues.setdefault(disks[branch], []).append((paths, c_stat, branch))
+    return queues
+
+
+def move_candidates(
+    candidates,
+    backend,
+    cache_path,
+    slow_path,
+    used,
+    total,
+    target,
+    num_files=-1,
+    time_limit=-1,
+    t_start=None,
+    branches=None,
+    jobs=0,
+    batch_size=1,
+    journal=None,
+    sample=None,
+    freed=freed_bytes,
+    settle=0,
+):
+    """
+    Move candidate groups until the target usage, --num-files or
+    --time-limit is reached.
+
+    Without `branches` groups go one after the other into `slow_path`. With
+    `branches` every destination disk gets its own worker thread and at most
+    `jobs` batches are in flight at once (0 means one per disk). The rsync
+    backend takes up to `batch_size` files per invocation; the native engine
+    always works one group at a time. With a `journal`, every group is
+    logged before and after it moves.
+
+    Usage is tracked by subtracting `freed(stat)` for every moved group.
+    Where that is only an estimate (compression, deferred frees), `sample`
+    returns the real used bytes: it is called more often as the target gets
+    closer, and groups moved in the last `settle` seconds, which the
+    filesystem may not reflect yet, are still subtracted from its result.
+
+    Returns (estimated used bytes, list of moved paths).
+    """
+    move_batch = MOVE_BACKENDS[backend]
+    if backend != "rsync":
+        batch_size = 1
+    t_start = time.monotonic() if t_start is None else t_start
+    if branches:
+        queues = assign_branches(candidates, cache_path, branches)
+    else:
+        queues = {None: [(paths, c_stat, slow_path) for paths, c_stat in candidates]}
+
+    lock = threading.Lock()
+    settled = threading.Condition(lock)
+    concurrency = min(jobs, len(queues)) if jobs > 0 else len(queues)
+    slots = threading.BoundedSemaphore(concurrency or 1)
+    throttle.workers = concurrency or 1
+    state = {'used': used, 'pending': 0, 'started': 0, 'stop': None, 'moved': []}
+    recent = collections.deque()  # (time, freed) of groups moved lately.
+    sampling = {'next': t_start + SAMPLE_INTERVAL[0], 'freed': 0}
+
+    def resample():
+        now = time.monotonic()
+        if sample is None or now < sampling['next']:
+            return
+        while recent and now - recent[0][0] > settle:
+            recent.popleft()
+        estimate = state['used']
+        state['used'] = sample() - sum(n for _, n in recent)
+        # Sample again after about half the time the remaining bytes
+        # should take at the rate seen so far.
+        remaining = state['used'] - state['pending'] - target * total / 100
+        rate = sampling['freed'] / max(now - t_start, 1e-3)
+        interval = remaining / rate / 2 if rate > 0 else SAMPLE_INTERVAL[0]
+        sampling['next'] = now + min(max(interval, SAMPLE_INTERVAL[0]), SAMPLE_INTERVAL[1])
+        syslog.syslog(
+            syslog.LOG_DEBUG,
+            f"Sampled usage {state['used']} bytes (estimated {estimate}); "
+            f"next sample in {sampling['next'] - now:.0f}s.",
+        )
+
+    def should_stop():
+        if state['stop']:
+            return True
+        resample()
+        if num_files >= 0 and state['started'] >= num_files:
+            state['stop'] = f"Maximum number of moved files reached ({num_files})."
+        elif time_limit >= 0 and time.monotonic() - t_start > time_limit:
+            state['stop'] = f"Time limit reached ({time_limit} seconds)."
+        elif (100 * (state['used'] - state['pending']) / total) <= target:
+            # Bytes still in flight may yet fail; only final once settled.
+            if state['pending'] == 0:
+                state['stop'] = f"Target of maximum used capacity reached ({target})."
+            return True
+        return state['stop'] is not None
+
+    def take(queue):
+        batch = []
+        files = 0
+        with lock:
+            while files < batch_size:
+                if should_stop():
+                    if batch or state['stop'] or not state['pending']:
+                        break
+                    # Only the bytes other workers have in flight cover the
+                    # target; they may yet fail, so wait for them to settle.
+                    settled.wait(SAMPLE_INTERVAL[0])
+                    continue
+                group = next(queue, None)
+                if group is None:
+                    break
+                paths, c_stat, dest = group
+                syslog.syslog(syslog.LOG_DEBUG, f"{paths[0]} -> {dest}")
+                if not paths[0].exists():
+                    # Vanished since the scan (e.g. deleted by a user).
+                    syslog.syslog(syslog.LOG_WARNING, f"{paths[0]} does not exist.")
+                    metrics.count('missing', len(paths))
+                    continue
+                if num_files >= 0 and state['started'] + len(paths) > num_files:
+                    # A hard-link group moves whole or not at all.
+                    state['stop'] = f"Maximum number of moved files reached ({num_files})."
+                    break
+                state['started'] += len(paths)
+                state['pending'] += freed(c_stat)
+                files += len(paths)
+                batch.append(group)
+                if journal:
+                    journal.begin(paths, dest)
+        return batch
+
+    def worker(queue):
+        queue = iter(queue)
+        while True:
+            throttle.wait_idle()
+            batch = take(queue)
+            if not batch:
+                return
+            with slots:
+                results = move_batch(batch, cache_path)
+            with lock:
+                for (paths, c_stat, _), moved in zip(batch, results):
+                    if journal:
+                        journal.done(paths, moved)
+                    state['pending'] -= freed(c_stat)
+                    metrics.count('moved' if moved else 'failed', len(paths), freed(c_stat))
+                    if moved:
+                        state['used'] -= freed(c_stat)
+                        state['moved'].extend(paths)
+                        sampling['freed'] += freed(c_stat)
+                        if sample is not None and settle:
+                            recent.append((time.monotonic(), freed(c_stat)))
+                settled.notify_all()
+
+    t_move = time.perf_counter()
+    if len(queues) == 1:
+        worker(next(iter(queues.values())))
+    else:
+        syslog.syslog(
+            syslog.LOG_INFO,
+            f"Moving to {len(queues)} disks: "
+            + ", ".join(f"{d} ({len(q)} groups)" for d, q in queues.items()),
+        )
+        threads = [
+            threading.Thread(target=worker, args=(q,), name=f"mover-{d}")
+            for d, q in queues.items()
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    metrics.add('move', time.perf_counter() - t_move)
+
+    with lock:
+        should_stop()
+    if state['stop']:
+        syslog.syslog(syslog.LOG_INFO, state['stop'])
+    return state['used'], state['moved']
+
+
+# Bounds, in seconds, of the adaptive interval at which move_candidates()
+# re-reads the real pool usage when given a `sample` callable.
+SAMPLE_INTERVAL = (2, 60)
+
+
+PLAN_FIELDS = ['group', 'path', 'dev', 'ino', 'nlink', 'size', 'blocks', 'freed', 'atime', 'mtime']
+
+
+def write_plan(groups, cache_path, deficit, output="-", fmt="json"):
+    """
+    Write the eviction plan: one entry per hard-link group with the bytes it
+    frees. CSV has one row per path, groups sharing the same `group` number.
+    """
+    file = sys.stdout if output == "-" else open(output, "w", newline="")
+    try:
+        if fmt == "csv":
+            writer = csv.writer(file)
+            writer.writerow(PLAN_FIELDS)
+            for n, (paths, st) in enumerate(groups):
+                for path in paths:
+                    writer.writerow([
+                        n, os.fspath(path), st.st_dev, st.st_ino, st.st_nlink,
+                        st.st_size, st.st_blocks, freed_bytes(st), st.st_atime, st.st_mtime,
+                    ])
+        else:
+            json.dump(
+                {
+                    'cache_path': os.fspath(cache_path),
+                    'created': time.time(),
+                    'deficit': deficit,
+                    'freed': sum(freed_bytes(st) for _, st in groups),
+                    'groups': [
+                        {
+                            'paths': [os.fspath(p) for p in paths],
+                            'dev': st.st_dev,
+                            'ino': st.st_ino,
+                            'nlink': st.st_nlink,
+                            'size': st.st_size,
+                            'blocks': st.st_blocks,
+                            'freed': freed_bytes(st),
+                            'atime': st.st_atime,
+                            'mtime': st.st_mtime,
+                        }
+                        for paths, st in groups
+                    ],
+                },
+                file,
+                indent=1,
+            )
+            file.write("\n")
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+
+def read_plan(plan_path):
+    """
+    Load a plan written by write_plan() and re-validate it against the disk.
+
+    Groups whose first path is gone or whose inode, size or mtime changed
+    since the plan was made are dropped with a warning.
+
+    Returns a list of (paths, stat) groups in plan order.
+    """
+    with open(plan_path, newline="") as file:
+        if plan_path.endswith(".csv"):
+            planned = {}
+            for row in csv.DictReader(file):
+                entry = planned.setdefault(row['group'], dict(row, paths=[]))
+                entry['paths'].append(row['path'])
+            planned = list(planned.values())
+        else:
+            planned = json.load(file)['groups']
+
+    return validate_plan(planned)
+
+
+def validate_plan(planned):
+    """Re-stat planned entries, dropping the ones that vanished or changed."""
+    groups = []
+    for entry in planned:
+        paths = entry['paths']
+        try:
+            st = os.lstat(paths[0])
+        except OSError:
+            syslog.syslog(syslog.LOG_WARNING, f"{paths[0]} does not exist.")
+            metrics.count('missing', len(paths))
+            continue
+        if (st.st_ino, st.st_size, st.st_mtime) != (
+            int(entry['ino']), int(entry['size']), float(entry['mtime'])
+        ):
+            syslog.syslog(syslog.LOG_WARNING, f"{paths[0]} changed since the plan was made.")
+            continue
+        groups.append((paths, st))
+    return groups
+
+
+def open_inodes():
+    """
+    Return {(st_dev, st_ino)} of every regular file a process holds open,
+    maps into memory or runs, from a single pass over /proc. This is what
+    `fuser` would find, but for all files at once.
+    """
+    inodes = set()
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        proc = f"/proc/{pid}"
+        try:
+            fds = [f"{proc}/fd/{fd}" for fd in os.listdir(f"{proc}/fd")]
+        except OSError:
+            continue  # Exited, or a kernel thread we may not inspect.
+        for link in fds + [f"{proc}/exe", f"{proc}/cwd"]:
+            try:
+                st = os.stat(link)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode):
+                inodes.add((st.st_dev, st.st_ino))
+        try:
+            with open(f"{proc}/maps") as maps:
+                for line in maps:
+                    # address perms offset dev inode [pathname]
+                    fields = line.split(None, 5)
+                    if len(fields) < 5 or fields[4] == '0':
+                        continue
+                    major, minor = fields[3].split(':')
+                    inodes.add((os.makedev(int(major, 16), int(minor, 16)), int(fields[4])))
+        except OSError:
+            continue
+    return inodes
+
+
+def prune_empty_dirs(top, cache_path, slow_path):
+    """
+    Remove empty directories below and including `top`, bottom-up, making
+    sure each one also exists on the slow pool first so empty directories
+    are carried over instead of lost.
+    """
+    for directory, _, _ in os.walk(top, topdown=False):
+        try:
+            if os.listdir(directory):
+                continue
+            make_parents(os.path.relpath(directory, cache_path), cache_path, slow_path)
+            os.rmdir(directory)
+        except OSError as e:
+            syslog.syslog(syslog.LOG_WARNING, f"Unable to remove {directory}: {e}")
+
+
+def acquire_lock(pid_file):
+    """
+    Hold an exclusive flock() on `pid_file` for the life of the process and
+    record our PID in it. Unlike a bare PID file, the lock disappears with
+    the process, so a killed mover never blocks the next run. The PID is
+    cleared at interpreter exit, whichever path the mover leaves by.
+    """
+    fd = os.open(pid_file, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print('Fatal error: Mover script already executing. Check PID file.')
+        sys.exit(1)
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    atexit.register(release_lock, fd)
+    return fd
+
+
+def release_lock(fd):
+    """
+    Clear the PID from a lock taken with acquire_lock() and drop the lock.
+    The file itself stays: unlinking it while locked would let the next
+    instance lock the old inode while another one creates a fresh file.
+    """
+    if fd is None:
+        return
+    os.ftruncate(fd, 0)
+    os.close(fd)
+
+
+class Journal:
+    """
+    Write-ahead journal of a mover run, as JSON lines.
+
+    The plan is recorded before anything moves, then every group gets a
+    `begin` record (fsync'ed) before its copy starts and a `done` record
+    once it settled. A journal left behind by a killed run tells the next
+    run which moves were in flight and which planned groups are left.
+    """
+
+    def __init__(self, path=JOURNAL):
+        self.path = path
+        self.file = None
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def _write(self, record, sync=False):
+        with self.lock:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            if sync:
+                os.fsync(self.file.fileno())
+
+    def start(self, groups, cache_path, backend):
+        """Record the plan about to be executed."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "w")
+        self.ids = {os.fspath(paths[0]): n for n, (paths, _) in enumerate(groups)}
+        self._write(
+            {
+                'op': 'plan',
+                'cache_path': os.fspath(cache_path),
+                'backend': backend,
+                'groups': [
+                    {
+                        'paths': [os.fspath(p) for p in paths],
+                        'ino': st.st_ino,
+                        'size': st.st_size,
+                        'mtime': st.st_mtime,
+                    }
+                    for paths, st in groups
+                ],
+            },
+            sync=True,
+        )
+
+    def begin(self, paths, dest):
+        self._write(
+            {'op': 'begin', 'id': self.ids[os.fspath(paths[0])], 'dest': os.fspath(dest)},
+            sync=True,
+        )
+
+    def done(self, paths, moved):
+        self._write({'op': 'done', 'id': self.ids[os.fspath(paths[0])], 'moved': moved})
+
+    def finish(self):
+        """The run ended normally; nothing to recover next time."""
+        if self.file:
+            self.file.close()
+            self.file = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def recover(self, cache_path):
+        """
+        Settle a run that was interrupted, then return its remaining plan as
+        (paths, stat) groups, or None when there is nothing to resume.
+
+        In-flight groups are rolled forward when the destination holds a
+        complete copy (same size and mtime), otherwise their temporary files
+        are removed and the sources are put back in the plan.
+        """
+        try:
+            with open(self.path) as file:
+                records = []
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break  # Torn last line.
+        except FileNotFoundError:
+            return None
+        if not records or records[0].get('op') != 'plan':
+            self.finish()
+            return None
+        plan = records[0]
+        if plan['cache_path'] != os.fspath(cache_path):
+            syslog.syslog(
+                syslog.LOG_WARNING,
+                f"Journal {self.path} belongs to {plan['cache_path']}; ignoring it.",
+            )
+            return None
+
+        begun = {}
+        done = set()
+        for record in records[1:]:
+            if record['op'] == 'begin':
+                begun[record['id']] = record['dest']
+            elif record['op'] == 'done':
+                done.add(record['id'])
+
+        syslog.syslog(
+            syslog.LOG_WARNING,
+            f"Recovering interrupted run: {len(done)} of {len(plan['groups'])} groups done, "
+            f"{len(set(begun) - done)} in flight.",
+        )
+        remaining = []
+        for n, entry in enumerate(plan['groups']):
+            if n in done:
+                continue
+            if n not in begun:
+                remaining.extend(validate_plan([entry]))
+                continue
+            left = self._settle(entry['paths'], cache_path, begun[n], plan['backend'])
+            if left:
+                remaining.append((left, os.lstat(left[0])))
+        self.finish()
+        return remaining
+
+    @staticmethod
+    def _settle(paths, cache_path, dest, backend):
+        """Finish or roll back one in-flight group; return the paths still to move."""
+        left = []
+        moved = None  # Destination of a member that already made it over.
+        for c_path in paths:
+            rel = os.path.relpath(c_path, cache_path)
+            dst = os.path.join(dest, rel)
+            name = os.path.basename(rel)
+            temp = re.compile(
+                rf"^{re.escape(_tmp_prefix(name))}[A-Za-z0-9_]+{re.escape(TMP_SUFFIX)}$"
+                if backend == "native"
+                else rf"^\.{re.escape(name)}\.[A-Za-z0-9]{{6}}$"
+            )
+            try:
+                for entry in os.scandir(os.path.dirname(dst)):
+                    if temp.match(entry.name):
+                        os.unlink(entry.path)
+                        syslog.syslog(syslog.LOG_INFO, f"Removed partial copy {entry.path}.")
+            except OSError:
+                pass
+            try:
+                src = os.lstat(c_path)
+            except FileNotFoundError:
+                # Already moved.
+                if moved is None and os.path.lexists(dst):
+                    moved = dst
+                continue
+            try:
+                copy = os.lstat(dst)
+            except FileNotFoundError:
+                left.append(c_path)
+                continue
+            if (copy.st_size, copy.st_mtime_ns) == (src.st_size, src.st_mtime_ns):
+                os.unlink(c_path)
+                syslog.syslog(syslog.LOG_INFO, f"Completed interrupted move of {c_path}.")
+                moved = moved or dst
+            else:
+                left.append(c_path)
+        if moved is None:
+            return left
+        # Part of a hard-link group made it over: link the rest to it rather
+        # than moving them again as separate copies.
+        for c_path in list(left):
+            try:
+                src = os.lstat(c_path)
+                copy = os.lstat(moved)
+                if (copy.st_size, copy.st_mtime_ns) != (src.st_size, src.st_mtime_ns):
+                    continue
+                _link_into(moved, c_path, src, cache_path, dest)
+            except OSError:
+                continue
+            left.remove(c_path)
+            syslog.syslog(syslog.LOG_INFO, f"Linked {c_path} to already moved {moved}.")
+        return left
+
+
+class _StatusHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.request.sendall(json.dumps(self.server.daemon_status()).encode() + b"\n")
+
+
+class _StatusServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MoverDaemon:
+    """
+    Watermark-driven eviction loop for --daemon.
+
+    `usage()` returns (used, total) bytes and must be cheap (statvfs, zpool
+    list); it runs every `interval` seconds. Once usage reaches `high`
+    percent, `evict(used, total)` is called to bring it down to the low
+    watermark, and nothing happens again until usage climbs back to `high`.
+    A Unix socket at `socket_path` answers every connection with one JSON
+    status line (e.g. `socat - UNIX-CONNECT:/run/uncache-mover.sock`).
+    """
+
+    def __init__(self, usage, evict, high, low, interval=10, socket_path=STATUS_SOCKET):
+        if high <= low:
+            raise ValueError(f"High watermark ({high}%) must be above the target ({low}%).")
+        self.usage = usage
+        self.evict = evict
+        self.high = high
+        self.low = low
+        self.interval = interval
+        self.socket_path = socket_path
+        self.running = True
+        self.status = {
+            'pid': os.getpid(),
+            'started': time.time(),
+            'state': 'idle',
+            'high': high,
+            'low': low,
+            'usage': None,
+            'checked': None,
+            'cycles': 0,
+            'moved': 0,
+            'last_cycle': None,
+        }
+
+    def daemon_status(self):
+        return dict(self.status)
+
+    def stop(self, signum=None, frame=None):
+        # A cycle in progress finishes (bounded by --time-limit/--num-files).
+        self.running = False
+
+    def _serve(self):
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        server = _StatusServer(self.socket_path, _StatusHandler)
+        server.daemon_status = self.daemon_status
+        threading.Thread(target=server.serve_forever, name="status", daemon=True).start()
+        return server
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        server = self._serve()
+        syslog.syslog(
+            syslog.LOG_INFO,
+            f"Mover daemon started: evicting from {self.high}% down to {self.low}%, "
+            f"status on {self.socket_path}.",
+        )
+        try:
+            while self.running:
+                used, total = self.usage()
+                percentage = 100 * used / total
+                self.status.update(usage=percentage, checked=time.time())
+                if percentage >= self.high:
+                    self.status['state'] = 'evicting'
+                    syslog.syslog(
+                        syslog.LOG_INFO,
+                        f"Usage {percentage:.2f}% reached the {self.high}% high watermark.",
+                    )
+                    t_start = time.monotonic()
+                    moved = self.evict(used, total)
+                    self.status['cycles'] += 1
+                    self.status['moved'] += moved
+                    self.status['last_cycle'] = {
+                        'ended': time.time(),
+                        'seconds': time.monotonic() - t_start,
+                        'moved': moved,
+                    }
+                    self.status['state'] = 'idle'
+                time.sleep(self.interval)
+        finally:
+            server.shutdown()
+            server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        syslog.syslog(syslog.LOG_INFO, "Mover daemon stopped.")
@@ -3,37 +3,126 @@
 # File age time-based mover depending on goal % cache utilization.
 import argparse
 import shutil
-import subprocess
 import syslog
 import os 
-import sys
 import time
 from pathlib import Path
 
-CURRENT_PID = str(os.getpid())
+from moverlib import (
+    CacheIndex,
+    HeatStore,
+    Journal,
+    MoverDaemon,
+    Policy,
+    acquire_lock,
+    add_mover_arguments,
+    eviction_key,
+    freed_bytes,
+    metrics,
+    mergerfs_branches,
+    move_candidates,
+    promote,
+    read_plan,
+    resolve_branches,
+    select_candidates,
+    select_promotions,
+    setup_engine,
+    setup_throttle,
+    write_plan,
+)
+
 PID_FILE = '/var/run/uncache-mover.pid'
 CACHE_PATH = '/cache'
 MERGERFS_SLOW = '/mnt/slow-storage/'
 
-def check_pid():
-    """Check that PID file does not exist."""
-    try:
-        with open(PID_FILE) as file:
-            pid = int(file.readline())
-    except OSError:
-        # PID doesn't exist.
-        return 
-    print('Fatal error: Mover script already executing. Check PID file.')
-    sys.exit(1)
-
-def write_pid():
-    """Create a PID File."""
-    try:
-        with open(PID_FILE, "w") as file:
-            file.write(CURRENT_PID)
-    except OSError:
-        print(f"Fatal Error: Unable to write pid file {PID_FILE}")
-        sys.exit(1)
+
+def evict(args, cache_path, slow_path, used, total, target, index=None, journal=None, resumed=None):
+    """
+    Move the coldest files off the cache until `target`% of `total` is used.
+    Returns the moved paths (the planned ones on --dry-run, which moves none).
+    """
+    metrics.reset()
+    metrics.set_capacity('before', used, total)
+    labels = {'mover': 'uncache-mover', 'cache': str(cache_path)}
+    syslog.syslog(syslog.LOG_INFO, "Computing candidates...")
+    # Only keep the coldest files needed to get below target; the rest of the
+    # pool is streamed past without being retained.
+    deficit = used - target * total / 100
+    if args.plan:
+        selected = read_plan(args.plan)
+        syslog.syslog(syslog.LOG_INFO, f"Loaded {len(selected)} groups from plan {args.plan}.")
+    elif resumed:
+        selected = resumed
+        syslog.syslog(syslog.LOG_INFO, f"Resuming interrupted run with {len(selected)} groups left.")
+    else:
+        policy = Policy.load(args.policy, cache_path) if args.policy else None
+        if index:
+            with metrics.timed('scan'):
+                listed = index.refresh(
+                    cache_path, restat=args.restat, prune=policy.prune if policy else None
+                )
+            syslog.syslog(
+                syslog.LOG_INFO, f"Index refreshed ({listed} directories rescanned)."
+            )
+        selected = select_candidates(
+            cache_path,
+            deficit,
+            index=index,
+            key=eviction_key(args, cache_path),
+            policy=policy,
+            compact=args.compact,
+        )
+
+    if args.dry_run:
+        write_plan(selected, cache_path, deficit, args.plan_output, args.plan_format)
+        syslog.syslog(
+            syslog.LOG_INFO,
+            f"Dry run: {len(selected)} groups freeing {sum(freed_bytes(st) for _, st in selected)} bytes planned.",
+        )
+        metrics.export(args, labels)
+        return [p for paths, _ in selected for p in paths]
+
+    candidates = [([Path(c) for c in paths], c_stat) for paths, c_stat in selected]
+
+    journal.start(selected, cache_path, args.backend)
+    branches = resolve_branches(args.branches, slow_path)
+    setup_engine(args)
+    setup_throttle(
+        args, [cache_path] + (branches or mergerfs_branches(slow_path) or [slow_path])
+    )
+    t_start = time.monotonic()
+    syslog.syslog(syslog.LOG_INFO, f"Processing candidates with the {args.backend} backend...")
+    cache_used, moved = move_candidates(
+        candidates,
+        args.backend,
+        cache_path,
+        slow_path,
+        used,
+        total,
+        target,
+        num_files=args.num_files,
+        time_limit=args.time_limit,
+        t_start=t_start,
+        branches=branches,
+        jobs=args.jobs,
+        batch_size=args.batch_size,
+        journal=journal,
+    )
+    journal.finish()
+
+    if index:
+        for c_path in moved:
+            index.forget(c_path)
+
+    cache_stats = shutil.disk_usage(cache_path)
+    usage_percentage = 100 * cache_stats.used / cache_stats.total
+    metrics.set_capacity('after', cache_stats.used, cache_stats.total)
+    metrics.export(args, labels)
+    syslog.syslog(
+        syslog.LOG_INFO,
+        f"Process completed in {round(time.monotonic() - t_start)} seconds. Current usage percentage is {usage_percentage:.2f}%.",
+    )
+    return moved
 
 
 if __name__ == "__main__":
@@ -50,11 +139,12 @@ if __name__ == "__main__":
 
     In this way least accessed files will be moved one after the other
     until the percentage of used capacity will be less than the target.
+    With --promote, a run that finds the cache below that low watermark
+    moves frequently read files from the slow pool back instead.
     Other options are also available. Please consider this is a work in
     progress.
     """
 
-    check_pid()
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-s",
@@ -91,21 +181,45 @@ if __name__ == "__main__":
         type=float,
         help="Desired max cache usage, in percentage (e.g. 70).",
     )
+    parser.add_argument(
+        "--promote",
+        dest="promote",
+        default=None,
+        type=float,
+        help="Low watermark, in percentage: below it, hot files on the slow pool are moved back to the cache.",
+    )
+    parser.add_argument(
+        "--promote-min-heat",
+        dest="promote_min_heat",
+        default=3.0,
+        type=float,
+        help="Decayed accesses (see heat-tracker.py) a slow file needs to be promoted.",
+    )
     parser.add_argument(
         "-v", "--verbose", help="Increase output verbosity.", action="store_true"
     )
+    add_mover_arguments(parser)
     args = parser.parse_args()
 
     # Some general checks
-    cache_path: Path = args.source
+    cache_path: Path = args.source.absolute()
     if not cache_path.is_dir():
         raise NotADirectoryError(f"{cache_path} is not a valid directory.")
     slow_path: Path = args.destination
     if not slow_path.is_dir():
         raise NotADirectoryError(f"{slow_path} is not a valid directory.")
 
-    last_id = args.num_files
-    time_limit = args.time_limit
+    if args.daemon and (args.dry_run or args.plan):
+        parser.error("--daemon cannot be combined with --dry-run or --plan.")
+    if args.backend == "rsync" and (args.checksum or args.checksum_verify):
+        parser.error("--checksum and --checksum-verify need the native backend.")
+
+    # Single instance; the lock goes away with the process, even on a crash.
+    if not args.dry_run:
+        acquire_lock(PID_FILE)
+    # Settle whatever an interrupted run left in flight before measuring usage.
+    journal = Journal(args.journal)
+    resumed = None if args.dry_run else journal.recover(cache_path)
 
     target = float(args.target)
     if target <= 1 or target >= 100:
@@ -113,6 +227,44 @@ if __name__ == "__main__":
             f"Target value is in percentage, i.e. in the range of (0, 100). Found {target} instead."
         )
 
+    if args.daemon:
+        # The index stays open (in memory unless --index is given) so every
+        # cycle only rescans the directories that changed.
+        index = CacheIndex(args.index or ':memory:')
+
+        def usage():
+            st = os.statvfs(cache_path)
+            return (st.f_blocks - st.f_bfree) * st.f_frsize, st.f_blocks * st.f_frsize
+
+        def cycle(used, total):
+            # The first cycle finishes the groups an interrupted run left behind.
+            global resumed
+            groups, resumed = resumed, None
+            return len(
+                evict(
+                    args,
+                    cache_path,
+                    slow_path,
+                    used,
+                    total,
+                    target,
+                    index,
+                    journal,
+                    resumed=groups,
+                )
+            )
+
+        MoverDaemon(
+            usage,
+            cycle,
+            high=args.high if args.high is not None else min(target + 10, 99),
+            low=target,
+            interval=args.poll_interval,
+            socket_path=args.socket,
+        ).run()
+        index.close()
+        exit(0)
+
     cache_stats = shutil.disk_usage(cache_path)
 
     usage_percentage = 100 * cache_stats.used / cache_stats.total
@@ -120,6 +272,31 @@ if __name__ == "__main__":
         syslog.LOG_INFO,
         f"Uncaching from {cache_path} ({usage_percentage:.2f}% used) to {slow_path}.",
     )
+    if args.promote is not None and usage_percentage < min(args.promote, target):
+        # Reverse tiering: refill the cache with what is being read from
+        # the spindles, up to the low watermark.
+        headroom = args.promote * cache_stats.total / 100 - cache_stats.used
+        heat = HeatStore(args.heat_db)
+        roots = [slow_path] + mergerfs_branches(slow_path)
+        history = {}
+        for root in roots:
+            history.update(heat.history(root))
+        picked = select_promotions(
+            history, roots, cache_path, headroom, args.promote_min_heat
+        )
+        syslog.syslog(
+            syslog.LOG_INFO,
+            f"Promoting {len(picked)} hot files ({sum(freed_bytes(p[2]) for p in picked)} bytes) "
+            f"to {cache_path}, below the {args.promote}% low watermark.",
+        )
+        if args.dry_run:
+            for path, _, st, _ in picked:
+                print(f"{path}\t{freed_bytes(st)}")
+        else:
+            setup_throttle(args, [cache_path] + (mergerfs_branches(slow_path) or [slow_path]))
+            promote(picked, cache_path, heat)
+        heat.close()
+        exit(0)
     if usage_percentage <= target:
         syslog.syslog(
             syslog.LOG_INFO,
@@ -127,75 +304,17 @@ if __name__ == "__main__":
         )
         exit(0)
 
-    # Create PID file.
-    write_pid()
-    syslog.syslog(syslog.LOG_INFO, "Computing candidates...")
-    candidates = sorted(
-        [(c, c.stat()) for c in cache_path.glob("**/*") if c.is_file()],
-        key=lambda p: p[1].st_atime,
-    )
-
-    t_start = time.monotonic()
-    syslog.syslog(syslog.LOG_INFO, "Processing candidates...")
-    cache_used = cache_stats.used
-    for c_id, (c_path, c_stat) in enumerate(candidates):
-        syslog.syslog(syslog.LOG_DEBUG, f"{c_path}")
-
-        if not c_path.exists():
-            # Since rsync moves also other hard links it might be that
-            # some files are not existing anymore. However, invoking rsync
-            # for each file (instead of directories) does not preserve
-            # hard links.
-            syslog.syslog(syslog.LOG_WARNING, f"{c_path} does not exist.")
-            continue
-
-        # Rsync options
-        # -a, --archive               archive mode; equals -rlptgoD (no -H,-A,-X)
-        # -x, --one-file-system       don't cross filesystem boundaries
-        # -q, --quiet                 suppress non-error messages
-        # -H, --hard-links            preserve hard links
-        # -A, --acls                  preserve ACLs (implies --perms)
-        # -X, --xattrs                preserve extended attributes
-        # -W, --whole-file            copy files whole (without delta-xfer algorithm)
-        # -E, --executability         preserve the file's executability
-        # -S, --sparse                turn sequences of nulls into sparse blocks
-        # -R, --relative              use relative path names
-        # --preallocate               allocate dest files before writing them
-        # --remove-source-files       sender removes synchronized files (non-dirs)
-        subprocess.call(
-            [
-                "rsync",
-                "-axqHAXWESR",
-                "--preallocate",
-                "--remove-source-files",
-                f"{cache_path}/./{c_path.relative_to(cache_path)}",
-                f"{slow_path}/",
-            ]
-        )
-        cache_used -= c_stat.st_size
-
-        # Evaluate early breaking conditions
-        if last_id >= 0 and c_id >= last_id - 1:
-            syslog.syslog(
-                syslog.LOG_INFO, f"Maximum number of moved files reached ({last_id})."
-            )
-            break
-        if time_limit >= 0 and time.monotonic() - t_start > time_limit:
-            syslog.syslog(
-                syslog.LOG_INFO, f"Time limit reached ({time_limit} seconds)."
-            )
-            break
-        if (100 * cache_used / cache_stats.total) <= target:
-            syslog.syslog(
-                syslog.LOG_INFO, f"Target of maximum used capacity reached ({target})."
-            )
-            break
-
-    cache_stats = shutil.disk_usage(cache_path)
-    usage_percentage = 100 * cache_stats.used / cache_stats.total
-    syslog.syslog(
-        syslog.LOG_INFO,
-        f"Process completed in {round(time.monotonic() - t_start)} seconds. Current usage percentage is {usage_percentage:.2f}%.",
+    index = CacheIndex(args.index) if args.index and not (args.plan or resumed) else None
+    evict(
+        args,
+        cache_path,
+        slow_path,
+        cache_stats.used,
+        cache_stats.total,
+        target,
+        index=index,
+        journal=journal,
+        resumed=resumed,
     )
-    # Successful exec; cleanup PID file.
-    os.unlink(PID_FILE)
\ No newline at end of file
+    if index:
+        index.close()
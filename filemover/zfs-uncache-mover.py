@@ -12,33 +12,34 @@ import syslog
 import time
 import re
 import os 
-import sys
 from pathlib import Path
 
+from moverlib import (
+    CacheIndex,
+    Journal,
+    MoverDaemon,
+    Policy,
+    acquire_lock,
+    add_mover_arguments,
+    eviction_key,
+    freed_bytes,
+    metrics,
+    mergerfs_branches,
+    move_candidates,
+    read_plan,
+    resolve_branches,
+    select_candidates,
+    setup_engine,
+    setup_throttle,
+    write_plan,
+)
+
 ZP = '/usr/sbin/zpool' # proxmox zpool path.
+ZFS = '/usr/sbin/zfs'
+TXG_TIMEOUT = '/sys/module/zfs/parameters/zfs_txg_timeout'
 PID_FILE = '/var/run/uncache-mover.pid'
+# Never moved when no --policy file is given.
 IGNORE_PATH = '/cache/media/downloads/incomplete/'
-CURRENT_PID = str(os.getpid())
-
-def check_pid():
-    """Check that PID file does not exist."""
-    try:
-        with open(PID_FILE) as file:
-            pid = int(file.readline())
-    except OSError:
-        # PID doesn't exist.
-        return 
-    print('Fatal error: Mover script already executing. Check PID file.')
-    sys.exit(1)
-
-def write_pid():
-    """Create a PID File."""
-    try:
-        with open(PID_FILE, "w") as file:
-            file.write(CURRENT_PID)
-    except OSError:
-        print(f"Fatal Error: Unable to write pid file {PID_FILE}")
-        sys.exit(1)
 
 def run(cmd, split=r'\t'):
     r = subprocess.check_output(
@@ -54,17 +55,80 @@ def pool_attributes(pool_name):
         "list",
         pool_name,
         "-Hpo",
-        "name,size,alloc,free,cap"
+        "name,size,alloc,free,freeing"
     ])
 
+    # Space still being freed in the background (e.g. destroyed datasets)
+    # is as good as free for our purposes.
     return {x[0]: {
         'name': x[0],
         'total': int(x[1]),
-        'used': int(x[2]),
+        'used': int(x[2]) - int(x[4]),
         'available': int(x[3]),
-        'usage_percentage': int(x[4]),
+        'usage_percentage': 100 * (int(x[2]) - int(x[4])) / int(x[1]),
     } for x in r}
 
+def dataset_ratios(pool_name):
+    """
+    Compression ratio (logicalused / used) of every mounted dataset of the
+    pool, keyed by the st_dev of its mountpoint.
+    """
+    props = {}
+    for name, prop, value in run([
+        ZFS,
+        "get",
+        "-Hpr",
+        "-t",
+        "filesystem",
+        "-o",
+        "name,property,value",
+        "used,logicalused,compressratio,mountpoint",
+        pool_name,
+    ]):
+        props.setdefault(name, {})[prop] = value
+
+    ratios = {}
+    for p in props.values():
+        try:
+            dev = os.stat(p['mountpoint']).st_dev
+        except (KeyError, OSError):
+            continue  # none, legacy or not mounted.
+        if int(p['used']) > 0:
+            ratio = int(p['logicalused']) / int(p['used'])
+        else:
+            ratio = float(p['compressratio'].rstrip('x'))
+        ratios[dev] = max(ratio, 1.0)
+    return ratios
+
+class PoolCapacity:
+    """
+    Live capacity of the cache pool for move_candidates().
+
+    st_blocks only reaches its compressed size once ZFS synced the file, and
+    deletes only show up in the pool's allocation a transaction group later,
+    so the running estimate is re-sampled from `zpool list` while moving.
+    """
+
+    def __init__(self, pool_name):
+        self.pool_name = pool_name
+        self.ratios = dataset_ratios(pool_name)
+        try:
+            with open(TXG_TIMEOUT) as file:
+                self.settle = int(file.read()) + 1
+        except (OSError, ValueError):
+            self.settle = 6
+
+    def sample(self):
+        return pool_attributes(self.pool_name)[self.pool_name]['used']
+
+    def freed(self, st):
+        """Bytes freed by moving a file, using its dataset's compression ratio
+        for data that has not been allocated yet."""
+        allocated = freed_bytes(st)
+        if allocated:
+            return allocated
+        return int(st.st_size / self.ratios.get(st.st_dev, 1.0))
+
 def sizeof_fmt(num, suffix="B"):
     for unit in ["", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"]:
         if abs(num) < 1024.0:
@@ -73,6 +137,103 @@ def sizeof_fmt(num, suffix="B"):
     return f"{num:.1f}Yi{suffix}"
 
 
+def evict(args, cache_path, slow_path, capacity, target, policy=None, index=None, journal=None, resumed=None):
+    """
+    Move the coldest files off the pool until `target`% of it is used.
+    Returns the moved paths (the planned ones on --dry-run, which moves none).
+    """
+    cache_stats = pool_attributes(capacity.pool_name)[capacity.pool_name]
+    metrics.reset()
+    metrics.set_capacity('before', cache_stats['used'], cache_stats['total'])
+    labels = {'mover': 'zfs-uncache-mover', 'cache': str(cache_path)}
+    syslog.syslog(syslog.LOG_INFO, "Computing candidates...")
+    deficit = cache_stats['used'] - target * cache_stats['total'] / 100
+    if args.plan:
+        selected = read_plan(args.plan)
+        syslog.syslog(syslog.LOG_INFO, f"Loaded {len(selected)} groups from plan {args.plan}.")
+    elif resumed:
+        selected = resumed
+        syslog.syslog(syslog.LOG_INFO, f"Resuming interrupted run with {len(selected)} groups left.")
+    else:
+        if index:
+            with metrics.timed('scan'):
+                listed = index.refresh(
+                    cache_path, restat=args.restat, prune=policy.prune if policy else None
+                )
+            syslog.syslog(
+                syslog.LOG_INFO, f"Index refreshed ({listed} directories rescanned)."
+            )
+        selected = select_candidates(
+            cache_path,
+            deficit,
+            index=index,
+            key=eviction_key(args, cache_path),
+            policy=policy,
+            compact=args.compact,
+        )
+
+    if args.dry_run:
+        write_plan(selected, cache_path, deficit, args.plan_output, args.plan_format)
+        syslog.syslog(
+            syslog.LOG_INFO,
+            f"Dry run: {len(selected)} groups freeing {sum(freed_bytes(st) for _, st in selected)} bytes planned.",
+        )
+        metrics.export(args, labels)
+        return [p for paths, _ in selected for p in paths]
+
+    candidates = [([Path(c) for c in paths], c_stat) for paths, c_stat in selected]
+
+    journal.start(selected, cache_path, args.backend)
+    branches = resolve_branches(args.branches, slow_path)
+    setup_engine(args)
+    setup_throttle(
+        args, [cache_path] + (branches or mergerfs_branches(slow_path) or [slow_path])
+    )
+    t_start = time.monotonic()
+    syslog.syslog(syslog.LOG_INFO, f"Processing candidates with the {args.backend} backend...")
+    cache_used, moved = move_candidates(
+        candidates,
+        args.backend,
+        cache_path,
+        slow_path,
+        cache_stats['used'],
+        cache_stats['total'],
+        target,
+        num_files=args.num_files,
+        time_limit=args.time_limit,
+        t_start=t_start,
+        branches=branches,
+        jobs=args.jobs,
+        batch_size=args.batch_size,
+        journal=journal,
+        sample=capacity.sample,
+        freed=capacity.freed,
+        settle=capacity.settle,
+    )
+    journal.finish()
+
+    if index:
+        for c_path in moved:
+            index.forget(c_path)
+
+    # Verify work is done.
+    cache_stats = pool_attributes(capacity.pool_name)[capacity.pool_name]
+    usage_percentage = cache_stats['usage_percentage']
+    metrics.set_capacity('after', cache_stats['used'], cache_stats['total'])
+    metrics.export(args, labels)
+
+    if policy:
+        syslog.syslog(
+            syslog.LOG_INFO,
+            f"There were {policy.pruned} paths skipped by never-move rules.",
+        )
+    syslog.syslog(
+        syslog.LOG_INFO,
+        f"Process completed in {round(time.monotonic() - t_start)} seconds. Current usage percentage is {usage_percentage:.2f}%.",
+    )
+    return moved
+
+
 if __name__ == "__main__":
     """
     Uncaching utility. This scripts assumes that you have a cache-like
@@ -86,7 +247,6 @@ if __name__ == "__main__":
     Other options are also available. Please consider this is a work in
     progress.
     """
-    check_pid()
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "-s",
@@ -124,21 +284,31 @@ if __name__ == "__main__":
     parser.add_argument(
         "-v", "--verbose", help="Increase output verbosity.", action="store_true"
     )
+    add_mover_arguments(parser)
     args = parser.parse_args()
 
     # Pool name sanitization
     zfs_pool_name_from_path = (str(args.source)).lstrip('/')
 
     # Some general checks
-    cache_path: Path = Path(args.source)
+    cache_path: Path = Path(args.source).absolute()
     if not cache_path.is_dir():
         raise NotADirectoryError(f"{cache_path} is not a valid directory.")
     slow_path: Path = Path(args.destination)
     if not slow_path.is_dir():
         raise NotADirectoryError(f"{slow_path} is not a valid directory.")
 
-    last_id = args.num_files
-    time_limit = args.time_limit
+    if args.daemon and (args.dry_run or args.plan):
+        parser.error("--daemon cannot be combined with --dry-run or --plan.")
+    if args.backend == "rsync" and (args.checksum or args.checksum_verify):
+        parser.error("--checksum and --checksum-verify need the native backend.")
+
+    # Single instance; the lock goes away with the process, even on a crash.
+    if not args.dry_run:
+        acquire_lock(PID_FILE)
+    # Settle whatever an interrupted run left in flight before measuring usage.
+    journal = Journal(args.journal)
+    resumed = None if args.dry_run else journal.recover(cache_path)
 
     target = float(args.target)
     if target <= 1 or target >= 100:
@@ -146,7 +316,56 @@ if __name__ == "__main__":
             f"Target value is in percentage, i.e. in the range of (0, 100). Found {target} instead."
         )
 
+    if args.policy:
+        policy = Policy.load(args.policy, cache_path)
+    elif Path(IGNORE_PATH).is_relative_to(cache_path):
+        policy = Policy(
+            cache_path, {'default': {'never': [str(Path(IGNORE_PATH).relative_to(cache_path))]}}
+        )
+    else:
+        policy = None
+
     # Initial ZFS filesystem checks
+    capacity = PoolCapacity(zfs_pool_name_from_path)
+
+    if args.daemon:
+        # The index stays open (in memory unless --index is given) so every
+        # cycle only rescans the directories that changed.
+        index = CacheIndex(args.index or ':memory:')
+
+        def usage():
+            stats = pool_attributes(zfs_pool_name_from_path)[zfs_pool_name_from_path]
+            return stats['used'], stats['total']
+
+        def cycle(used, total):
+            # The first cycle finishes the groups an interrupted run left behind.
+            global resumed
+            groups, resumed = resumed, None
+            return len(
+                evict(
+                    args,
+                    cache_path,
+                    slow_path,
+                    capacity,
+                    target,
+                    policy,
+                    index,
+                    journal,
+                    resumed=groups,
+                )
+            )
+
+        MoverDaemon(
+            usage,
+            cycle,
+            high=args.high if args.high is not None else min(target + 10, 99),
+            low=target,
+            interval=args.poll_interval,
+            socket_path=args.socket,
+        ).run()
+        index.close()
+        exit(0)
+
     zfs_data = pool_attributes(zfs_pool_name_from_path)
     cache_stats = zfs_data[zfs_pool_name_from_path]
 
@@ -162,89 +381,17 @@ if __name__ == "__main__":
         )
         exit(0)
 
-    # Create PID file.
-    write_pid()
-    syslog.syslog(syslog.LOG_INFO, "Computing candidates...")
-    candidates = sorted(
-        [(c, c.stat()) for c in cache_path.glob("**/*") if c.is_file()],
-        key=lambda p: p[1].st_atime,
-    )
-
-    t_start = time.monotonic()
-    syslog.syslog(syslog.LOG_INFO, "Processing candidates...")
-    cache_used = cache_stats['used']
-    ignored_files = 0
-
-
-    for c_id, (c_path, c_stat) in enumerate(candidates):
-        syslog.syslog(syslog.LOG_DEBUG, f"{c_path}")
-
-        if not c_path.exists():
-            # Since rsync moves also other hard links it might be that
-            # some files are not existing anymore. However, invoking rsync
-            # for each file (instead of directories) does not preserve
-            # hard links.
-            syslog.syslog(syslog.LOG_WARNING, f"{c_path} does not exist.")
-            continue
-
-        if c_path.is_relative_to(IGNORE_PATH):
-            ignored_files += 1
-            continue
-        # Rsync options
-        # -a, --archive               archive mode; equals -rlptgoD (no -H,-A,-X)
-        # -x, --one-file-system       don't cross filesystem boundaries
-        # -q, --quiet                 suppress non-error messages
-        # -H, --hard-links            preserve hard links
-        # -A, --acls                  preserve ACLs (implies --perms)
-        # -X, --xattrs                preserve extended attributes
-        # -W, --whole-file            copy files whole (without delta-xfer algorithm)
-        # -E, --executability         preserve the file's executability
-        # -S, --sparse                turn sequences of nulls into sparse blocks
-        # -R, --relative              use relative path names
-        # --preallocate               allocate dest files before writing them
-        # --remove-source-files       sender removes synchronized files (non-dirs)
-        subprocess.call(
-            [
-                "rsync",
-                "-axqHAXWESR",
-                "--preallocate",
-                "--remove-source-files",
-                f"{cache_path}/./{c_path.relative_to(cache_path)}",
-                f"{slow_path}/",
-            ]
-        )
-        cache_used -= c_stat.st_size
-
-        # Evaluate early breaking conditions
-        if last_id >= 0 and c_id >= last_id - 1:
-            syslog.syslog(
-                syslog.LOG_INFO, f"Maximum number of moved files reached ({last_id})."
-            )
-            break
-        if time_limit >= 0 and time.monotonic() - t_start > time_limit:
-            syslog.syslog(
-                syslog.LOG_INFO, f"Time limit reached ({time_limit} seconds)."
-            )
-            break
-        if (100 * cache_used / cache_stats['total']) <= target:
-            syslog.syslog(
-                syslog.LOG_INFO, f"Target of maximum used capacity reached ({target})."
-            )
-            break
-
-    # Verify work is done.
-    # Initial ZFS filesystem checks
-    zfs_data = pool_attributes(zfs_pool_name_from_path)
-    cache_stats = zfs_data[zfs_pool_name_from_path]
-    usage_percentage = 100 * cache_stats['used'] / cache_stats['total']
-
-    syslog.syslog(
-        syslog.LOG_INFO,
-        f"There were {ignored_files} file skipped due to being on {IGNORE_PATH} path.",
-    )
-    syslog.syslog(
-        syslog.LOG_INFO,
-        f"Process completed in {round(time.monotonic() - t_start)} seconds. Current usage percentage is {usage_percentage:.2f}%.",
+    index = CacheIndex(args.index) if args.index and not (args.plan or resumed) else None
+    evict(
+        args,
+        cache_path,
+        slow_path,
+        capacity,
+        target,
+        policy=policy,
+        index=index,
+        journal=journal,
+        resumed=resumed,
     )
-    # Successful exec; cleanup PID file.
-    os.unlink(PID_FILE)
\ No newline at end of file
+    if index:
+        index.close()